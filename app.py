@@ -5,13 +5,16 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from prophet import Prophet
-from sklearn.metrics import mean_absolute_error, mean_squared_error, mean_absolute_percentage_error, r2_score
-from scipy.signal import savgol_filter
+from scipy.signal import savgol_coeffs
 from io import BytesIO
 from datetime import datetime, timedelta
 import warnings
 import os
 import pickle
+import hashlib
+import functools
+import contextlib
+import re
 warnings.filterwarnings('ignore')
 
 # Конфигурация страницы
@@ -285,14 +288,158 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
+# HTML-шаблоны карточек (подставляется только текст)
+INSIGHT_CARD_TPL = '<div class="insight-card">{body}</div>'
+PROBLEM_CARD_TPL = '<div class="problem-card">{body}</div>'
+KEY_REC_TPL = (
+    '<div class="insight-card" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; margin-top: 20px;">'
+    '<h4 style="color: white; margin: 0 0 10px 0;">💡 Ключова рекомендація</h4>'
+    '<p style="margin: 0; font-size: 16px;">{body}</p>'
+    '</div>'
+)
+
+# Пороги классификации: индекс полосы ищется через np.searchsorted
+QUALITY_BANDS = np.array([60, 80])
+QUALITY_STATUS = [
+    ("red", "Потребує покращення", "❌"),
+    ("orange", "Добра", "⚠️"),
+    ("green", "Відмінна", "✅"),
+]
+
+MAPE_BANDS = np.array([10, 20])
+ACCURACY_RECS = [
+    "Дуже висока точність - можете впевнено планувати закупівлі",
+    "Добра точність - рекомендується буфер запасу 10-15%",
+    "Середня точність - тримайте страховий запас 20-30%",
+]
+
+PLANNING_BANDS = np.array([14, 30])
+PLANNING_RECS = [
+    "Короткострокове планування: фокус на оперативному управлінні запасами",
+    "Середньострокове планування: оптимізуйте замовлення у постачальників",
+    "Довгострокове планування: використовуйте для стратегічних рішень та бюджетування",
+]
+
+# ABC-классификация: A - до 80% накопленной выручки, B - до 95%, C - остальное
+ABC_BANDS = np.array([80.0, 95.0])
+ABC_CATEGORIES = ['A', 'B', 'C']
+ABC_LABELS = ['⭐ Категория A (80% выручки)', '🔶 Категория B (15% выручки)', '🔻 Категория C (5% выручки)']
+
+# Типы эластичности спроса, индекс: |e| > 1, |e| < 1, иначе единичная
+ELASTICITY_TYPES = ['Эластичный', 'Неэластичный', 'Единичный']
+ELASTICITY_RECS = ['Снижение цены увеличит выручку', 'Повышение цены увеличит выручку', 'Цена оптимальна']
+ELASTICITY_COLORS = np.array(['#ff6b6b', '#51cf66', '#ffd43b'])
+ELASTICITY_BG_STYLES = np.array(['background-color: #ffebee', 'background-color: #e8f5e9', 'background-color: #fff9c4'])
+
+# Направление тренда, индекс = sign(тренд) + 1
+TREND_OUTCOMES = (
+    ("знижується", "Оптимізуйте складські залишки, розгляньте промо-акції", "📉"),
+    ("стабільний", "Підтримуйте поточний рівень запасів", "➡️"),
+    ("зростає", "Збільшіть запаси та підготуйтеся до зростання попиту", "📈"),
+)
+
+# Эмодзи (и вариационный селектор U+FE0F), которые вырезаются из текста Word-отчета
+EMOJI_RE = re.compile('[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F]')
+
+# Подписи над столбцами месячных графиков выводятся только для коротких историй
+MONTHLY_BAR_LABEL_LIMIT = 24
+
+# Градиент Styler считается по ячейкам в Python, для длинных таблиц остается только формат
+STYLE_GRADIENT_ROW_LIMIT = 200
+
+def hash_dataframe(df):
+    """Хэширует DataFrame для ключей кэша: колоночный хэш pandas (с индексом и типами) вместо обхода через pickle"""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).values
+    return tuple(df.columns), tuple(map(str, df.dtypes)), hashlib.md5(row_hashes.tobytes()).hexdigest()
+
+def attach_data_key(df):
+    """Один раз при загрузке сохраняет ключ содержимого в df.attrs: функции над всем df кэшируются по нему"""
+    df.attrs['data_key'] = hash_dataframe(df)
+    return df
+
+def safe_divide(numerator, denominator):
+    """Поэлементное деление с нулем там, где знаменатель не больше нуля"""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+def gradient_styles(column, cmap, vmin=None, vmax=None):
+    """CSS фона колонки по colormap одним векторным вызовом (как background_gradient, с контрастным текстом)"""
+    from matplotlib import colormaps
+    values = column.to_numpy(dtype=float)
+    lo = np.nanmin(values) if vmin is None else vmin
+    hi = np.nanmax(values) if vmax is None else vmax
+    norm = np.clip((values - lo) / (hi - lo), 0, 1) if hi > lo else np.zeros_like(values)
+    rgb = colormaps[cmap](norm)[:, :3]
+    
+    # Относительная яркость фона (WCAG) определяет цвет текста, порог как в pandas
+    linear = np.where(rgb <= 0.03928, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    dark = linear @ np.array([0.2126, 0.7152, 0.0722]) < 0.408
+    
+    channels = np.round(rgb * 255).astype(int).astype(str)
+    css = np.char.add(np.char.add(np.char.add('background-color: rgb(', channels[:, 0]), ', '), channels[:, 1])
+    css = np.char.add(np.char.add(np.char.add(css, ', '), channels[:, 2]), ');')
+    css = np.char.add(css, np.where(dark, ' color: #f1f1f1;', ' color: #000000;'))
+    return np.where(np.isnan(values), '', css)
+
+def style_table(df, fmt, gradients=()):
+    """Styler таблицы: формат одним словарем, градиенты (готовые CSS-строки по колонкам) только для коротких таблиц"""
+    styler = df.style.format(fmt)
+    if len(df) <= STYLE_GRADIENT_ROW_LIMIT:
+        for gradient in gradients:
+            styler = styler.apply(gradient_styles, **gradient)
+    return styler
+
+def render_cards(bodies, template=INSIGHT_CARD_TPL):
+    """Выводит карточки одним st.markdown вместо отдельного вызова на каждую"""
+    if bodies:
+        st.markdown('\n'.join(template.format(body=body) for body in bodies), unsafe_allow_html=True)
+
+def read_excel_fast(uploaded_file):
+    """Читает Excel через calamine; повторную загрузку того же файла отдает кэш load_and_validate_data"""
+    file_bytes = uploaded_file.getvalue()
+    try:
+        return pd.read_excel(BytesIO(file_bytes), engine='calamine')
+    except ImportError:
+        # python-calamine не установлен - стандартный openpyxl
+        return pd.read_excel(BytesIO(file_bytes))
+
+def parse_sales_dates(dates):
+    """Приводит колонку дат к datetime, пропуская уже распознанные движком Excel"""
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    return pd.to_datetime(dates, errors='coerce', dayfirst=True, cache=True)
+
+CATEGORICAL_COLUMNS = ['Magazin', 'Segment', 'Art', 'Model', 'Describe']
+
+def optimize_dtypes(df):
+    """Сжимает типы колонок: категории для строк, int32 для целых количеств, float32 для сумм"""
+    df = df.copy()
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype('category')
+
+    qty = df['Qty']
+    if len(qty) > 0 and (qty == qty.round()).all() and qty.max() <= np.iinfo(np.int32).max:
+        df['Qty'] = qty.astype(np.int32)
+
+    # Суммы строк продаж в float32 хватает для дашборда; итоговые выручки суммируются в float64
+    df['Sum'] = df['Sum'].astype(np.float32)
+    return df
+
+def add_calendar_columns(df):
+    """Добавляет день недели и ISO-неделю продажи, чтобы не вычислять их на каждом прогоне"""
+    df['_dow'] = df['Datasales'].dt.dayofweek.astype(np.int8)
+    df['_week'] = df['Datasales'].dt.isocalendar().week.astype(np.int16)
+    return df
+
+@st.cache_data(max_entries=4, show_spinner=False)
 def load_and_validate_data(uploaded_file):
     """Загружает и валидирует данные из Excel файла"""
     try:
         progress_bar = st.progress(0)
         progress_bar.progress(25)
         
-        df = pd.read_excel(uploaded_file)
+        df = read_excel_fast(uploaded_file)
         progress_bar.progress(50)
         
         required_cols = ['Magazin', 'Datasales', 'Art', 'Describe', 'Model', 'Segment', 'Price', 'Qty', 'Sum']
@@ -309,9 +456,12 @@ def load_and_validate_data(uploaded_file):
         df['Qty'] = pd.to_numeric(df['Qty'], errors='coerce')
         df['Sum'] = pd.to_numeric(df['Sum'], errors='coerce')
 
-        df['Datasales'] = pd.to_datetime(df['Datasales'], errors='coerce', dayfirst=True)
+        df['Datasales'] = parse_sales_dates(df['Datasales'])
         df = df.dropna(subset=['Datasales']).sort_values('Datasales')
         df = df[(df['Qty'] >= 0) & (df['Price'] > 0)]
+        df = optimize_dtypes(df)
+        df = add_calendar_columns(df)
+        df = attach_data_key(df)
 
         progress_bar.progress(100)
         progress_bar.empty()
@@ -336,9 +486,13 @@ def load_from_google_sheets_cached(sheet_url, cache_duration_hours=1):
 
         # Если кэш свежий - загружаем из него
         if datetime.now() - cache_time < timedelta(hours=cache_duration_hours):
-            st.info(f"📦 Завантажено з кешу ({cache_time.strftime('%H:%M')})")
             with open(cache_file, 'rb') as f:
-                return pickle.load(f)
+                cached_df = pickle.load(f)
+
+            # Кэш старого формата (без календарных колонок) перезагружаем
+            if '_dow' in cached_df.columns:
+                st.info(f"📦 Завантажено з кешу ({cache_time.strftime('%H:%M')})")
+                return cached_df
 
     # Загружаем из Google Sheets
     progress_bar = st.progress(0)
@@ -371,9 +525,12 @@ def load_from_google_sheets_cached(sheet_url, cache_duration_hours=1):
         df['Qty'] = pd.to_numeric(df['Qty'], errors='coerce')
         df['Sum'] = pd.to_numeric(df['Sum'], errors='coerce')
 
-        df['Datasales'] = pd.to_datetime(df['Datasales'], errors='coerce', dayfirst=True)
+        df['Datasales'] = parse_sales_dates(df['Datasales'])
         df = df.dropna(subset=['Datasales']).sort_values('Datasales')
         df = df[(df['Qty'] >= 0) & (df['Price'] > 0)]
+        df = optimize_dtypes(df)
+        df = add_calendar_columns(df)
+        df = attach_data_key(df)
 
         # Сохраняем в кэш
         with open(cache_file, 'wb') as f:
@@ -459,9 +616,12 @@ def load_data_from_google_sheets(sheet_url):
         df['Sum'] = pd.to_numeric(df['Sum'], errors='coerce')
 
         # Обработка данных
-        df['Datasales'] = pd.to_datetime(df['Datasales'], errors='coerce', dayfirst=True)
+        df['Datasales'] = parse_sales_dates(df['Datasales'])
         df = df.dropna(subset=['Datasales']).sort_values('Datasales')
         df = df[(df['Qty'] >= 0) & (df['Price'] > 0)]
+        df = optimize_dtypes(df)
+        df = add_calendar_columns(df)
+        df = attach_data_key(df)
 
         progress_bar.progress(100)
         progress_bar.empty()
@@ -474,7 +634,7 @@ def load_data_from_google_sheets(sheet_url):
         st.info("💡 Переконайтеся, що таблиця опублікована (Файл -> Опублікувати в інтернеті)")
         return None
 
-def show_data_statistics(df):
+def show_data_statistics(df, daily_grid):
     """Отображает статистику данных"""
     st.markdown("## 📊 Статистика даних")
 
@@ -521,24 +681,92 @@ def show_data_statistics(df):
     with col1:
         st.info(f"📅 **Період даних**: {df['Datasales'].min().date()} - {df['Datasales'].max().date()}")
     with col2:
-        st.info(f"💰 **Загальна виручка**: {df['Sum'].sum():.0f} грн")
+        st.info(f"💰 **Загальна виручка**: {df['Sum'].to_numpy(dtype=np.float64).sum():.0f} грн")
     with col3:
-        st.info(f"📈 **Середні продажіві/день**: {df.groupby('Datasales')['Qty'].sum().mean():.1f} шт.")
+        st.info(f"📈 **Середні продажіві/день**: {select_daily_qty(daily_grid).mean():.1f} шт.")
+
+def category_equals(column, value):
+    """Сравнение столбца со значением по целочисленным кодам категорий"""
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        return (column == value).to_numpy()
+    try:
+        code = column.cat.categories.get_loc(value)
+    except KeyError:
+        return np.zeros(len(column), dtype=bool)
+    return column.cat.codes.to_numpy() == code
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def filter_sales(data_key, _df, magazin, segment):
+    """Фильтрует продажи по магазину и сегменту (результат кэшируется между перезапусками)"""
+    mask = np.ones(len(_df), dtype=bool)
+
+    if magazin != 'Всі магазини':
+        mask &= category_equals(_df['Magazin'], magazin)
+
+    if segment != 'Всі сегменти':
+        mask &= category_equals(_df['Segment'], segment)
+
+    return _df.iloc[np.flatnonzero(mask)].reset_index(drop=True)
+
+@st.cache_data(show_spinner=False)
+def aggregate_daily_qty(data_key, _df):
+    """Суммирует продажи по магазину, сегменту и дате за один проход по данным"""
+    return _df.groupby(['Magazin', 'Segment', 'Datasales'], observed=True, dropna=False)['Qty'].sum()
+
+@st.cache_data(show_spinner=False)
+def segment_volatility_table(data_key, _df):
+    """Статистика дневных продаж по каждой паре магазин/сегмент для расчета волатильности"""
+    return aggregate_daily_qty(data_key, _df).groupby(level=['Magazin', 'Segment'], observed=True).agg(['count', 'std', 'mean'])
+
+def select_daily_qty(daily_grid, magazin='Всі магазини', segment='Всі сегменти'):
+    """Дневные продажи выбранного магазина и сегмента из общей агрегации"""
+    if magazin != 'Всі магазини':
+        daily_grid = daily_grid[daily_grid.index.get_level_values('Magazin') == magazin]
+
+    if segment != 'Всі сегменти':
+        daily_grid = daily_grid[daily_grid.index.get_level_values('Segment') == segment]
+
+    # Сумма по датам через factorize + bincount вместо groupby
+    codes, dates = pd.factorize(daily_grid.index.get_level_values('Datasales'), sort=True)
+    totals = np.bincount(codes, weights=daily_grid.to_numpy(dtype=float), minlength=len(dates))
+    return pd.Series(totals, index=dates.rename('Datasales'), name='Qty')
 
 def remove_outliers_iqr(data, multiplier=1.5):
     """ИСПРАВЛЕНО: Удаляет выбросы методом IQR с корректным расчетом границ"""
     if len(data) < 4:
         return data
     
-    Q1 = data.quantile(0.25)
-    Q3 = data.quantile(0.75)
+    # Квартили и обрезка считаются напрямую по массиву NumPy
+    values = data.to_numpy()
+    Q1, Q3 = np.percentile(values, [25, 75])
     IQR = Q3 - Q1
     
     # ИСПРАВЛЕНИЕ: правильный расчет границ
     lower_bound = Q1 - multiplier * IQR
     upper_bound = Q3 + multiplier * IQR
     
-    return data.clip(lower=lower_bound, upper=upper_bound)
+    return pd.Series(np.clip(values, lower_bound, upper_bound), index=data.index, name=data.name)
+
+@functools.lru_cache(maxsize=32)
+def _sg_coeffs(window, polyorder):
+    """Коэффициенты Савицкого-Голея: центр окна и края (аналог mode='interp')"""
+    half = window // 2
+    center = savgol_coeffs(window, polyorder)
+    head = np.array([savgol_coeffs(window, polyorder, pos=i, use='dot') for i in range(half)])
+    tail = np.array([savgol_coeffs(window, polyorder, pos=window - half + i, use='dot') for i in range(half)])
+    return center, head, tail
+
+def savgol_smooth(values, window, polyorder):
+    """Фильтр Савицкого-Голея через свертку с закешированными коэффициентами"""
+    center, head, tail = _sg_coeffs(window, polyorder)
+    values = np.asarray(values, dtype=float)
+    half = window // 2
+    out = np.empty_like(values)
+    out[half:len(values) - half] = np.convolve(values, center, mode='valid')
+    if half:
+        out[:half] = head @ values[:window]
+        out[-half:] = tail @ values[-window:]
+    return out
 
 def smooth_data(data, method='ma', window=7):
     """Сглаживает данные различными методами"""
@@ -551,16 +779,16 @@ def smooth_data(data, method='ma', window=7):
         if window % 2 == 0:
             window += 1
         try:
-            return pd.Series(savgol_filter(data, window_length=window, polyorder=min(3, window-1)), index=data.index)
+            return pd.Series(savgol_smooth(data.to_numpy(), window, min(3, window-1)), index=data.index)
         except:
             return data.rolling(window=window, min_periods=1, center=True).mean()
     else:
         return data
 
-def prepare_prophet_data(df, remove_outliers=False, smooth_method=None, smooth_window=7):
-    """ИСПРАВЛЕНО: Подготавливает данные для Prophet с корректной агрегацией"""
-    # ИСПРАВЛЕНИЕ: агрегация данных по дате без суммы, только количество
-    daily_sales = df.groupby('Datasales')['Qty'].sum().reset_index()
+@st.cache_data(show_spinner=False)
+def prepare_prophet_data(selection_key, _daily_qty, remove_outliers=False, smooth_method=None, smooth_window=7):
+    """ИСПРАВЛЕНО: Подготавливает данные для Prophet из дневных сумм продаж"""
+    daily_sales = _daily_qty.reset_index()
     daily_sales.columns = ['ds', 'y']
     
     original_data = daily_sales.copy()
@@ -574,31 +802,52 @@ def prepare_prophet_data(df, remove_outliers=False, smooth_method=None, smooth_w
         daily_sales['y'] = smooth_data(daily_sales['y'], method=smooth_method, window=smooth_window)
     
     # ИСПРАВЛЕНИЕ: заменяем отрицательные значения на 0 вместо NaN
-    daily_sales['y'] = daily_sales['y'].clip(lower=0)
+    daily_sales['y'] = daily_sales['y'].clip(lower=0).astype(np.float32)
     
     return daily_sales, original_data
 
-def train_prophet_model(data, periods=30):
+@st.cache_resource(show_spinner=False)
+def fit_prophet_model(prophet_key, _data):
+    """Обучает Prophet на подготовленных данных (модель кэшируется между перезапусками)"""
+    model = Prophet(
+        daily_seasonality=False,
+        weekly_seasonality=True,
+        yearly_seasonality=True,
+        seasonality_mode='multiplicative',
+        changepoint_prior_scale=0.05,
+        seasonality_prior_scale=10
+    )
+
+    model.fit(_data)
+
+    return model
+
+@st.cache_data(show_spinner=False)
+def forecast_prophet(prophet_key, _data, periods):
+    """Строит прогноз Prophet на periods дней вперед (кэшируется по данным и горизонту)"""
+    model = fit_prophet_model(prophet_key, _data)
+
+    future = model.make_future_dataframe(periods=periods, include_history=False)
+    return model.predict(future)
+
+@st.cache_data(show_spinner=False)
+def predict_history(prophet_key, _data):
+    """Прогноз Prophet на исторических датах (для метрик точности и тренда)"""
+    model = fit_prophet_model(prophet_key, _data)
+    return model.predict(_data[['ds']])
+
+def clip_forecast(forecast):
+    """ИСПРАВЛЕНИЕ: обеспечиваем неотрицательные прогнозы (yhat и границы интервала)"""
+    forecast['yhat'] = forecast['yhat'].clip(lower=0)
+    forecast['yhat_lower'] = forecast['yhat_lower'].clip(lower=0)
+    forecast['yhat_upper'] = forecast['yhat_upper'].clip(lower=0)
+    return forecast
+
+def train_prophet_model(prophet_key, data, periods=30):
     """Обучает модель Prophet"""
     try:
-        model = Prophet(
-            daily_seasonality=False,
-            weekly_seasonality=True,
-            yearly_seasonality=True,
-            seasonality_mode='multiplicative',
-            changepoint_prior_scale=0.05,
-            seasonality_prior_scale=10
-        )
-        
-        model.fit(data)
-        
-        future = model.make_future_dataframe(periods=periods)
-        forecast = model.predict(future)
-        
-        # ИСПРАВЛЕНИЕ: обеспечиваем неотрицательные прогнозы
-        forecast['yhat'] = forecast['yhat'].clip(lower=0)
-        forecast['yhat_lower'] = forecast['yhat_lower'].clip(lower=0)
-        forecast['yhat_upper'] = forecast['yhat_upper'].clip(lower=0)
+        model = fit_prophet_model(prophet_key, data)
+        forecast = clip_forecast(forecast_prophet(prophet_key, data, periods))
         
         return model, forecast
         
@@ -606,11 +855,11 @@ def train_prophet_model(data, periods=30):
         st.error(f"❌ Ошибка при обучении модели: {str(e)}")
         return None, None
 
-def calculate_model_accuracy(train_data, model):
+def calculate_model_accuracy(prophet_key, train_data):
     """ИСПРАВЛЕНО: Корректный расчет метрик точности"""
     try:
         # Прогноз на исторических данных
-        historical_forecast = model.predict(train_data[['ds']])
+        historical_forecast = predict_history(prophet_key, train_data)
         
         y_true = train_data['y'].values
         y_pred = historical_forecast['yhat'].values
@@ -620,19 +869,28 @@ def calculate_model_accuracy(train_data, model):
         y_true = y_true[:min_len]
         y_pred = y_pred[:min_len]
         
-        # Расчет метрик
-        mae = mean_absolute_error(y_true, y_pred)
-        rmse = np.sqrt(mean_squared_error(y_true, y_pred))
+        # Расчет метрик по общему массиву остатков
+        errors = y_true - y_pred
+        abs_errors = np.abs(errors)
+        ss_res = np.dot(errors, errors)
+        mae = abs_errors.mean()
+        rmse = np.sqrt(ss_res / len(errors))
         
         # ИСПРАВЛЕНИЕ: безопасный расчет MAPE
         mask = y_true != 0
-        if mask.sum() > 0:
-            mape = np.mean(np.abs((y_true[mask] - y_pred[mask]) / y_true[mask])) * 100
+        if mask.any():
+            pct_errors = np.divide(abs_errors, np.abs(y_true), out=np.zeros_like(abs_errors), where=mask)
+            mape = pct_errors.sum() / np.count_nonzero(mask) * 100
         else:
             mape = 0
         
-        # R²
-        r2 = r2_score(y_true, y_pred)
+        # R² (при нулевой дисперсии — как в sklearn r2_score)
+        centered = y_true - y_true.mean()
+        ss_tot = np.dot(centered, centered)
+        if ss_tot > 0:
+            r2 = 1 - ss_res / ss_tot
+        else:
+            r2 = 1.0 if ss_res == 0 else 0.0
         
         return {
             'MAE': mae,
@@ -718,9 +976,10 @@ def plot_forecast(train_data, forecast, title):
     ))
     
     # Доверительный интервал
+    ds = forecast_future['ds'].to_numpy()
     fig.add_trace(go.Scatter(
-        x=forecast_future['ds'].tolist() + forecast_future['ds'].tolist()[::-1],
-        y=forecast_future['yhat_upper'].tolist() + forecast_future['yhat_lower'].tolist()[::-1],
+        x=np.concatenate([ds, ds[::-1]]),
+        y=np.concatenate([forecast_future['yhat_upper'].to_numpy(), forecast_future['yhat_lower'].to_numpy()[::-1]]),
         fill='toself',
         fillcolor='rgba(255, 127, 14, 0.2)',
         line=dict(color='rgba(255, 127, 14, 0)'),
@@ -761,31 +1020,51 @@ def plot_prophet_components(model, forecast):
     
     return fig
 
-def calculate_segment_volatility(df, magazin, segment):
+def plot_top_hbar(models, values, title, xaxis_title, colorscale, text_fmt, hover_label, categoryorder='total ascending'):
+    """Горизонтальный бар ТОП-моделей: трасса и layout передаются сразу в конструктор, без шкалы цвета"""
+    values = np.asarray(values, dtype=float)
+    return go.Figure(
+        data=[go.Bar(
+            y=models,
+            x=values,
+            orientation='h',
+            marker=dict(color=values, colorscale=colorscale, showscale=False),
+            text=[text_fmt.format(v) for v in values],
+            textposition='outside',
+            hovertemplate=f'<b>%{{y}}</b><br>{hover_label}<br><extra></extra>'
+        )],
+        layout=dict(
+            title=title,
+            xaxis_title=xaxis_title,
+            yaxis_title="Модель",
+            height=600,
+            yaxis={'categoryorder': categoryorder}
+        )
+    )
+
+def calculate_segment_volatility(vol_table, magazin, segment):
     """ИСПРАВЛЕНО: Корректный расчет волатильности сегмента"""
-    filtered = df[(df['Magazin'] == magazin) & (df['Segment'] == segment)]
-    
-    if len(filtered) < 2:
+    if (magazin, segment) not in vol_table.index:
         return 0.3  # Значение по умолчанию
     
-    daily_sales = filtered.groupby('Datasales')['Qty'].sum()
+    stats = vol_table.loc[(magazin, segment)]
     
-    if daily_sales.mean() == 0:
+    if stats['count'] < 2 or stats['mean'] == 0:
         return 0.3
     
     # ИСПРАВЛЕНИЕ: нормализованная волатильность (коэффициент вариации)
-    volatility = daily_sales.std() / daily_sales.mean()
+    volatility = stats['std'] / stats['mean']
     
     # Ограничиваем значение от 0 до 1
     return min(max(volatility, 0), 1)
 
 def get_forecast_scenarios(forecast_df, volatility):
     """ИСПРАВЛЕНО: Корректный расчет сценариев прогноза"""
-    realistic = forecast_df['yhat'].values
+    realistic = forecast_df['yhat'].to_numpy(dtype=np.float32)
     
     # ИСПРАВЛЕНИЕ: используем доверительные интервалы Prophet
-    lower_bound = forecast_df['yhat_lower'].values
-    upper_bound = forecast_df['yhat_upper'].values
+    lower_bound = forecast_df['yhat_lower'].to_numpy(dtype=np.float32)
+    upper_bound = forecast_df['yhat_upper'].to_numpy(dtype=np.float32)
     
     # Пессимистичный и оптимистичный сценарии
     pessimistic = np.maximum(lower_bound, 0)
@@ -802,8 +1081,9 @@ def show_forecast_statistics(filtered_df, forecast, forecast_days, magazin, segm
     total_forecast = future_forecast['yhat'].sum()
     
     # ИСПРАВЛЕНИЕ: безопасный расчет средней цены
-    if len(filtered_df) > 0 and filtered_df['Qty'].sum() > 0:
-        avg_price = filtered_df['Sum'].sum() / filtered_df['Qty'].sum()
+    total_qty = filtered_df['Qty'].sum()
+    if len(filtered_df) > 0 and total_qty > 0:
+        avg_price = filtered_df['Sum'].to_numpy(dtype=np.float64).sum() / total_qty
     else:
         avg_price = 0
     
@@ -829,53 +1109,81 @@ def show_forecast_statistics(filtered_df, forecast, forecast_days, magazin, segm
             f"{forecast_revenue:.0f} ГРН"
         )
 
-def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_days, remove_outliers, smooth_method):
-    """Расширенный анализ по месяцам с множественными графиками и статистикой"""
-    # Фильтрация данных
-    filtered = df.copy()
-    
-    if magazin != 'Всі магазини':
-        filtered = filtered[filtered['Magazin'] == magazin]
-    
-    if segment != 'Всі сегменти':
-        filtered = filtered[filtered['Segment'] == segment]
-    
-    if len(filtered) == 0:
-        st.warning("⚠️ Недостатньо даних для месячного анализа")
-        return
+def month_floor(dates):
+    """Округляет даты до начала месяца приведением типа numpy (без PeriodIndex)"""
+    values = dates.to_numpy()
+    return values.astype('datetime64[M]').astype(values.dtype)
+
+@st.cache_data(show_spinner=False)
+def build_monthly_data(data_key, _df, magazin, segment):
+    """Помесячные продажи, выручка и ассортимент для выбранного магазина и сегмента"""
+    filtered = filter_sales(data_key, _df, magazin, segment)
     
-    # Группировка по месяцам
-    filtered['Month'] = filtered['Datasales'].dt.to_period('M')
-    monthly_data = filtered.groupby('Month').agg({
+    # Группировка по месяцам; Sum хранится в float32, итоги выручки суммируются в float64
+    months = pd.Series(month_floor(filtered['Datasales']), index=filtered.index, name='Month')
+    columns = filtered[['Qty', 'Art']].assign(Sum=filtered['Sum'].astype(np.float64))
+    monthly_data = columns.groupby(months).agg({
         'Qty': 'sum',
         'Sum': 'sum',
         'Art': 'nunique'
     }).reset_index()
     monthly_data.columns = ['Month', 'Qty', 'Sum', 'Unique_Products']
     
-    monthly_data['Month'] = monthly_data['Month'].dt.to_timestamp()
-    
     # Расчет средней цены и других метрик
-    monthly_data['Avg_Price'] = np.where(
-        monthly_data['Qty'] > 0,
-        monthly_data['Sum'] / monthly_data['Qty'],
-        0
-    )
+    monthly_data['Avg_Price'] = safe_divide(monthly_data['Sum'], monthly_data['Qty'])
+    return monthly_data
+
+WEEKDAY_NAMES_RU = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+WEEKDAY_SHORT_RU = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+def weekday_aggregates(df):
+    """Продажи по дням недели и тепловая карта неделя x день за один проход bincount"""
+    dow = df['_dow'].to_numpy(dtype=np.int64)
+    week = df['_week'].to_numpy(dtype=np.int64)
+    qty = df['Qty'].to_numpy(dtype=float)
+    sums = df['Sum'].to_numpy(dtype=float)
+    
+    # Номера дней и недель, которые реально встречаются в данных
+    days = np.flatnonzero(np.bincount(dow, minlength=7))
+    weeks = np.flatnonzero(np.bincount(week, minlength=54))
+    
+    weekday_stats = pd.DataFrame({
+        'Weekday': days,
+        'Weekday_Name_RU': [WEEKDAY_NAMES_RU[d] for d in days],
+        'Qty': np.bincount(dow, weights=qty, minlength=7)[days],
+        'Sum': np.bincount(dow, weights=sums, minlength=7)[days]
+    })
     
-    # Прогноз на будущий месяц
-    future_dates = pd.date_range(
-        start=filtered['Datasales'].max() + pd.Timedelta(days=1),
-        periods=forecast_days
-    )
-    future_df = pd.DataFrame({'ds': future_dates})
-    future_forecast = model.predict(future_df)
+    cells = np.bincount(week * 7 + dow, weights=qty, minlength=54 * 7).reshape(-1, 7)
+    heatmap_pivot = pd.DataFrame(cells[np.ix_(weeks, days)], index=weeks, columns=days)
+    
+    return weekday_stats, heatmap_pivot
+
+def plot_monthly_analysis_with_forecast(data_key, df, magazin, segment, prophet_key, prophet_data, forecast_days, remove_outliers, smooth_method):
+    """Расширенный анализ по месяцам с множественными графиками и статистикой"""
+    monthly_data = build_monthly_data(data_key, df, magazin, segment)
+
+    if len(monthly_data) == 0:
+        st.warning("⚠️ Недостатньо даних для месячного анализа")
+        return
+
+    qty_arr = monthly_data['Qty'].to_numpy()
+    sum_arr = monthly_data['Sum'].to_numpy()
+    price_arr = monthly_data['Avg_Price'].to_numpy()
+    prod_arr = monthly_data['Unique_Products'].to_numpy()
+    avg_monthly_sales = qty_arr.mean()
+    avg_monthly_revenue = sum_arr.mean()
+    avg_price_overall = price_arr.mean()
+    
+    # Прогноз на будущий месяц (тот же закэшированный прогноз, что и на основном графике)
+    future_forecast = forecast_prophet(prophet_key, prophet_data, forecast_days)
     
     # Агрегация прогноза по месяцам
-    future_forecast['Month'] = pd.to_datetime(future_forecast['ds']).dt.to_period('M').dt.to_timestamp()
-    forecast_monthly = future_forecast.groupby('Month')['yhat'].sum().reset_index()
+    forecast_months = pd.Series(month_floor(future_forecast['ds']), index=future_forecast.index, name='Month')
+    forecast_monthly = future_forecast.groupby(forecast_months)['yhat'].sum().reset_index()
     forecast_monthly.columns = ['Month', 'Forecast_Qty']
     
-    last_avg_price = monthly_data['Avg_Price'].iloc[-1] if len(monthly_data) > 0 else 0
+    last_avg_price = price_arr[-1] if len(price_arr) > 0 else 0
     forecast_monthly['Forecast_Revenue'] = forecast_monthly['Forecast_Qty'] * last_avg_price
     
     # === СТАТИСТИКА МЕСЯЧНОГО АНАЛИЗА ===
@@ -884,29 +1192,27 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        avg_monthly_sales = monthly_data['Qty'].mean()
         st.metric(
             "📦 Средние продажіви/месяц",
             f"{avg_monthly_sales:.0f} шт",
-            delta=f"{monthly_data['Qty'].iloc[-1] - avg_monthly_sales:.0f}"
+            delta=f"{qty_arr[-1] - avg_monthly_sales:.0f}"
         )
     
     with col2:
-        avg_monthly_revenue = monthly_data['Sum'].mean()
         st.metric(
             "💰 Средняя выручка/месяц",
             f"{avg_monthly_revenue:.0f} ГРН",
-            delta=f"{monthly_data['Sum'].iloc[-1] - avg_monthly_revenue:.0f}"
+            delta=f"{sum_arr[-1] - avg_monthly_revenue:.0f}"
         )
     
     with col3:
         # Рост продажів (последний месяц vs предыдущий)
         if len(monthly_data) >= 2:
-            growth_rate = ((monthly_data['Qty'].iloc[-1] / monthly_data['Qty'].iloc[-2]) - 1) * 100
+            growth_rate = ((qty_arr[-1] / qty_arr[-2]) - 1) * 100
             st.metric(
                 "📈 Рост (месяц к месяцу)",
                 f"{growth_rate:+.1f}%",
-                delta=f"{monthly_data['Qty'].iloc[-1] - monthly_data['Qty'].iloc[-2]:.0f} шт"
+                delta=f"{qty_arr[-1] - qty_arr[-2]:.0f} шт"
             )
         else:
             st.metric("📈 Рост", "N/A")
@@ -915,7 +1221,7 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
         # Прогноз роста
         if len(forecast_monthly) > 0 and len(monthly_data) > 0:
             # Сравниваем последний прогнозный месяц с последним фактическим месяцем
-            forecast_growth = ((forecast_monthly['Forecast_Qty'].iloc[-1] / monthly_data['Qty'].iloc[-1]) - 1) * 100
+            forecast_growth = ((forecast_monthly['Forecast_Qty'].iloc[-1] / qty_arr[-1]) - 1) * 100
             st.metric(
                 "🔮 Прогноз роста",
                 f"{forecast_growth:+.1f}%",
@@ -927,6 +1233,8 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     # === ГРАФИК 1: Продажи и выручка ===
     st.markdown("### 📊 График продажів и выручки")
     
+    show_bar_labels = len(monthly_data) <= MONTHLY_BAR_LABEL_LIMIT
+    
     fig1 = go.Figure()
     
     # Фактические продажіви
@@ -936,9 +1244,9 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
         name='Фактические продажіви',
         marker_color='#1f77b4',
         yaxis='y',
-        text=monthly_data['Qty'].round(0),
+        text=monthly_data['Qty'].round(0) if show_bar_labels else None,
         textposition='outside',
-        texttemplate='%{text:.0f}'
+        texttemplate='%{text:.0f}' if show_bar_labels else None
     ))
     
     # Прогнозные продажіви
@@ -982,10 +1290,11 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
         hovermode='x unified',
         height=500,
         legend=dict(x=0, y=1.15, orientation='h'),
-        barmode='group'
+        barmode='group',
+        uirevision='monthly_analysis'
     )
     
-    st.plotly_chart(fig1, use_container_width=True, key="plot_forecast_fig1")
+    st.plotly_chart(fig1, key="plot_forecast_fig1")
     
     # === ГРАФИК 2: Динамика средней цены ===
     st.markdown("### 💵 Динамика средней цены")
@@ -1004,7 +1313,6 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     ))
     
     # Добавляем среднюю линию
-    avg_price_overall = monthly_data['Avg_Price'].mean()
     fig2.add_hline(
         y=avg_price_overall,
         line_dash="dash",
@@ -1017,10 +1325,11 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
         xaxis_title="Месяц",
         yaxis_title="Средняя цена (ГРН)",
         hovermode='x unified',
-        height=400
+        height=400,
+        uirevision='monthly_analysis'
     )
     
-    st.plotly_chart(fig2, use_container_width=True, key="plot_forecast_fig2")
+    st.plotly_chart(fig2, key="plot_forecast_fig2")
     
     # === ГРАФИК 3: Уникальные товары и интенсивность продажів ===
     st.markdown("### 🏷️ Ассортимент и интенсивность продажів")
@@ -1035,7 +1344,7 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
             y=monthly_data['Unique_Products'],
             name='Уникальных товаров',
             marker_color='#8c564b',
-            text=monthly_data['Unique_Products'],
+            text=monthly_data['Unique_Products'] if show_bar_labels else None,
             textposition='outside'
         ))
         
@@ -1043,14 +1352,15 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
             title="Кількість уникальных товаров",
             xaxis_title="Месяц",
             yaxis_title="Кол-во товаров",
-            height=350
+            height=350,
+            uirevision='monthly_analysis'
         )
         
-        st.plotly_chart(fig3, use_container_width=True, key="plot_forecast_fig3")
+        st.plotly_chart(fig3, key="plot_forecast_fig3")
     
     with col2:
         # Интенсивность продажів (продажіви на 1 товар)
-        monthly_data['Sales_per_Product'] = monthly_data['Qty'] / monthly_data['Unique_Products']
+        monthly_data['Sales_per_Product'] = safe_divide(qty_arr, prod_arr)
         
         fig4 = go.Figure()
         
@@ -1069,10 +1379,11 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
             title="Интенсивность продажів (шт/товар)",
             xaxis_title="Месяц",
             yaxis_title="Продаж на 1 товар",
-            height=350
+            height=350,
+            uirevision='monthly_analysis'
         )
         
-        st.plotly_chart(fig4, use_container_width=True, key="plot_forecast_fig4")
+        st.plotly_chart(fig4, key="plot_forecast_fig4")
     
     # === ГРАФИК 4: Сравнение факт vs прогноз ===
     if len(forecast_monthly) > 0:
@@ -1081,12 +1392,14 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
         # Берем последние 6 місяців історії
         recent_months = monthly_data.tail(6)
         
-        comparison_data = pd.DataFrame({
-            'Категория': ['Последние 6 мес (факт)'] * len(recent_months) + ['Прогноз'] * len(forecast_monthly),
-            'Период': list(recent_months['Month']) + list(forecast_monthly['Month']),
-            'Продажи': list(recent_months['Qty']) + list(forecast_monthly['Forecast_Qty']),
-            'Выручка': list(recent_months['Sum']) + list(forecast_monthly['Forecast_Revenue'])
-        })
+        comparison_data = pd.concat([
+            recent_months[['Month', 'Qty', 'Sum']]
+                .set_axis(['Период', 'Продажи', 'Выручка'], axis=1)
+                .assign(Категория='Последние 6 мес (факт)'),
+            forecast_monthly[['Month', 'Forecast_Qty', 'Forecast_Revenue']]
+                .set_axis(['Период', 'Продажи', 'Выручка'], axis=1)
+                .assign(Категория='Прогноз')
+        ], ignore_index=True)
         
         fig5 = go.Figure()
         
@@ -1109,21 +1422,21 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
             xaxis_title="Период",
             yaxis_title="Продажи (шт)",
             height=400,
-            barmode='group'
+            barmode='group',
+            uirevision='monthly_analysis'
         )
         
-        st.plotly_chart(fig5, use_container_width=True, key="plot_forecast_fig5")
+        st.plotly_chart(fig5, key="plot_forecast_fig5")
     
     # === ТАБЛИЦА С ДЕТАЛЬНОЙ СТАТИСТИКОЙ ===
     st.markdown("### 📋 Детальная статистика по месяцам")
     
-    # Создаем расширенную таблицу
-    display_table = monthly_data.copy()
-    display_table['Month'] = display_table['Month'].dt.strftime('%Y-%m')
-    
-    # Добавляем процент изменения
-    display_table['Qty_Change_%'] = display_table['Qty'].pct_change() * 100
-    display_table['Revenue_Change_%'] = display_table['Sum'].pct_change() * 100
+    # Создаем расширенную таблицу с процентом изменения (assign строит новую таблицу без отдельной копии)
+    display_table = monthly_data.assign(**{
+        'Month': monthly_data['Month'].dt.strftime('%Y-%m'),
+        'Qty_Change_%': monthly_data['Qty'].pct_change() * 100,
+        'Revenue_Change_%': monthly_data['Sum'].pct_change() * 100
+    })
     
     display_table = display_table.rename(columns={
         'Month': '📅 Месяц',
@@ -1138,7 +1451,7 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     
     # Форматирование
     st.dataframe(
-        display_table.style.format({
+        style_table(display_table, {
             '📦 Продажи': '{:.0f}',
             '💰 Выручка': '{:.0f}',
             '💵 Средняя цена': '{:.2f}',
@@ -1146,7 +1459,9 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
             '📊 Продаж/товар': '{:.1f}',
             '📈 Δ Продаж %': '{:+.1f}%',
             '💹 Δ Выручка %': '{:+.1f}%'
-        }).background_gradient(subset=['📈 Δ Продаж %', '💹 Δ Выручка %'], cmap='RdYlGn', vmin=-20, vmax=20),
+        }, [
+            dict(subset=['📈 Δ Продаж %', '💹 Δ Выручка %'], cmap='RdYlGn', vmin=-20, vmax=20)
+        ]),
         use_container_width=True,
         hide_index=True
     )
@@ -1159,8 +1474,8 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     
     # Проверка падения продажів
     if len(monthly_data) >= 2:
-        last_month_sales = monthly_data['Qty'].iloc[-1]
-        prev_month_sales = monthly_data['Qty'].iloc[-2]
+        last_month_sales = qty_arr[-1]
+        prev_month_sales = qty_arr[-2]
         
         if last_month_sales < prev_month_sales * 0.8:
             alerts.append("📉 **КРИТИЧНО**: Падение продажів более 20% за последний месяц!")
@@ -1171,8 +1486,8 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     
     # Проверка роста цены
     if len(monthly_data) >= 3:
-        recent_price = monthly_data['Avg_Price'].tail(3).mean()
-        older_price = monthly_data['Avg_Price'].head(3).mean()
+        recent_price = price_arr[-3:].mean()
+        older_price = price_arr[:3].mean()
         
         if recent_price > older_price * 1.15:
             alerts.append("💵 Средняя цена выросла более чем на 15%")
@@ -1180,8 +1495,8 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     
     # Проверка ассортимента
     if len(monthly_data) >= 2:
-        last_products = monthly_data['Unique_Products'].iloc[-1]
-        avg_products = monthly_data['Unique_Products'].mean()
+        last_products = prod_arr[-1]
+        avg_products = prod_arr.mean()
         
         if last_products < avg_products * 0.7:
             alerts.append("🏷️ Резкое сокращение ассортимента")
@@ -1189,7 +1504,7 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     
     # Проверка прогноза
     if len(forecast_monthly) > 0 and len(monthly_data) > 0:
-        forecast_vs_last = forecast_monthly['Forecast_Qty'].iloc[0] / monthly_data['Qty'].iloc[-1]
+        forecast_vs_last = forecast_monthly['Forecast_Qty'].iloc[0] / qty_arr[-1]
         
         if forecast_vs_last > 1.3:
             alerts.append("🚀 Прогноз показывает рост продажів более 30%")
@@ -1200,79 +1515,321 @@ def plot_monthly_analysis_with_forecast(df, magazin, segment, model, forecast_da
     
     # Сезонность
     if len(monthly_data) >= 6:
-        monthly_data_temp = monthly_data.copy()
-        monthly_data_temp['Month_Num'] = pd.to_datetime(monthly_data_temp['Month']).dt.month
-        seasonality = monthly_data_temp.groupby('Month_Num')['Qty'].mean().std()
+        month_nums = monthly_data['Month'].dt.month.to_numpy()
+        month_counts = np.bincount(month_nums, minlength=13)
+        month_means = safe_divide(np.bincount(month_nums, weights=qty_arr, minlength=13), month_counts)
+        seasonality = month_means[month_counts > 0].std(ddof=1)
         
-        if seasonality > monthly_data['Qty'].mean() * 0.3:
+        if seasonality > avg_monthly_sales * 0.3:
             recommendations.append("📅 Выявлена высокая сезонность - планируйте закупки с учетом сезонных колебаний")
     
     # Отображение алертов
     if alerts:
-        for alert in alerts:
-            st.markdown(f'<div class="problem-card">{alert}</div>', unsafe_allow_html=True)
+        render_cards(alerts, PROBLEM_CARD_TPL)
     else:
         st.success("✅ Критичних проблем не виявлено")
     
     # Отображение рекомендаций
     if recommendations:
         st.markdown("#### 💡 Рекомендации:")
-        for rec in recommendations:
-            st.markdown(f'<div class="insight-card">{rec}</div>', unsafe_allow_html=True)
+        render_cards(recommendations)
     
     # Дополнительные рекомендации
     st.markdown("#### 🎯 Общие рекомендации:")
     
     general_recommendations = [
-        f"📊 Средняя цена: {monthly_data['Avg_Price'].mean():.2f} ГРН - {'оптимальна' if monthly_data['Avg_Price'].std() < monthly_data['Avg_Price'].mean() * 0.2 else 'сильно варьируется'}",
-        f"📦 Оптимальный запас на месяц: {monthly_data['Qty'].mean() * 1.2:.0f} одиниць (среднее + 20% буфер)",
-        f"💰 Целевая выручка на следующий месяц: {monthly_data['Sum'].mean() * 1.1:.0f} ГРН (+10% к среднему)"
+        f"📊 Средняя цена: {avg_price_overall:.2f} ГРН - {'оптимальна' if price_arr.std(ddof=1) < avg_price_overall * 0.2 else 'сильно варьируется'}",
+        f"📦 Оптимальный запас на месяц: {avg_monthly_sales * 1.2:.0f} одиниць (среднее + 20% буфер)",
+        f"💰 Целевая выручка на следующий месяц: {avg_monthly_revenue * 1.1:.0f} ГРН (+10% к среднему)"
     ]
     
     for rec in general_recommendations:
         st.info(rec)
     
-def get_top_models_by_segment(df, magazin):
-    """Получает топ-10 моделей по каждому сегменту"""
-    filtered = df[df['Magazin'] == magazin]
+@st.cache_data(show_spinner=False)
+def get_top_models_by_segment(data_key, _df, magazin):
+    """Получает топ-10 моделей по каждому сегменту (колонки уже подписаны для таблицы)"""
+    filtered = _df[_df['Magazin'] == magazin]
     segments = filtered['Segment'].unique()
     
-    result = {}
+    # Одна агрегация по всем сегментам вместо отдельного прохода на каждый (выручка - в float64)
+    columns = filtered[['Segment', 'Model', 'Qty']].assign(Sum=filtered['Sum'].astype(np.float64))
+    models = columns.groupby(['Segment', 'Model'], observed=True).agg({
+        'Qty': 'sum',
+        'Sum': 'sum'
+    }).reset_index()
     
-    for segment in segments:
-        segment_data = filtered[filtered['Segment'] == segment]
-        
-        top_models = segment_data.groupby('Model').agg({
-            'Qty': 'sum',
-            'Sum': 'sum'
-        }).reset_index()
-        
-        # ИСПРАВЛЕНИЕ: безопасный расчет средней цены
-        top_models['Price'] = np.where(
-            top_models['Qty'] > 0,
-            top_models['Sum'] / top_models['Qty'],
-            0
-        )
-        
-        top_models = top_models.sort_values('Sum', ascending=False).head(10)
-        result[segment] = top_models
+    # ИСПРАВЛЕНИЕ: безопасный расчет средней цены
+    models['Price'] = safe_divide(models['Sum'], models['Qty'])
     
-    return result
-
-def generate_insights(df, forecast, magazin, segment):
-    """Генерирует инсайты и рекомендации"""
-    filtered = df[(df['Magazin'] == magazin) & (df['Segment'] == segment)]
+    top_models = models.sort_values('Sum', ascending=False, kind='stable').groupby('Segment', observed=True).head(10)
     
+    # Колонки для отображения переименовываются один раз для всех сегментов
+    segment_keys = top_models.pop('Segment')
+    top_models = top_models[['Model', 'Qty', 'Sum', 'Price']].rename(columns={
+        'Model': '🏷️ Модель',
+        'Qty': '📦 Кількість',
+        'Sum': '💰 Выручка (ГРН)',
+        'Price': '💵 Средняя цена'
+    })
+    
+    # Разбиение на сегменты за один проход; порядок вкладок — порядок появления сегментов
+    groups = dict(tuple(top_models.groupby(segment_keys, observed=True)))
+    
+    return {segment: groups.get(segment, top_models.iloc[:0]) for segment in segments}
+
+@st.cache_data(show_spinner=False)
+def compute_conclusions(selection_key, _filtered_df, period_end):
+    """Продажи за последний месяц и динамика цены первых/последних 30 записей (кэшируется)"""
+    # Маска по массиву дат с границей периода, посчитанной в main
+    last_30_mask = _filtered_df['Datasales'].to_numpy() >= (period_end - pd.Timedelta(days=30)).to_datetime64()
+
+    recent_price = older_price = None
+    if len(_filtered_df) >= 30:
+        # Средняя цена последних и первых 30 записей: каждый срез суммируется один раз
+        qty = _filtered_df['Qty'].to_numpy()
+        sums = _filtered_df['Sum'].to_numpy(dtype=np.float64)
+        recent_price = safe_divide(sums[-30:].sum(), qty[-30:].sum()).item()
+        older_price = safe_divide(sums[:30].sum(), qty[:30].sum()).item()
+
+    return {
+        'trend_last_month': _filtered_df['Qty'].to_numpy()[last_30_mask].sum(),
+        'recent_price': recent_price,
+        'older_price': older_price
+    }
+
+def model_codes(df):
+    """Коды и имена моделей: готовые коды категориальной Model (см. optimize_dtypes) без повторной факторизации"""
+    model = df['Model']
+    if isinstance(model.dtype, pd.CategoricalDtype):
+        return model.cat.codes.to_numpy(), model.cat.categories
+    return pd.factorize(model, sort=False)
+
+def sorted_group_quantile(values, starts, sizes, q):
+    """Квантиль (линейная интерполяция, как в pandas) для групп, лежащих в values отсортированными подряд"""
+    pos = q * (sizes - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, sizes - 1)
+    v_lo = values[starts + lo]
+    return v_lo + (values[starts + hi] - v_lo) * (pos - lo)
+
+@st.cache_data(show_spinner=False)
+def compute_price_elasticity(data_key, _df):
+    """Эластичность спроса по моделям между крайними ценовыми группами (кэшируется)"""
+    codes, models = model_codes(_df)
+    has_model = codes >= 0
+    codes = codes[has_model]
+    price = _df['Price'].to_numpy(dtype=float)[has_model]
+    qty = _df['Qty'].to_numpy(dtype=float)[has_model]
+    sums = _df['Sum'].to_numpy(dtype=float)[has_model]
+
+    # Строки сортируются один раз по (модель, цена): каждая модель - непрерывный отрезок по возрастанию цены
+    order = np.lexsort((price, codes))
+    codes, price, qty, sums = codes[order], price[order], qty[order], sums[order]
+    sizes = np.bincount(codes, minlength=len(models))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+    # Минимум 10 записей для анализа модели
+    groups = np.flatnonzero(sizes >= 10)
+    g_starts, g_sizes = starts[groups], sizes[groups]
+
+    # Границы ценовых групп как у pd.qcut: терцили, а если они совпадают - 2 группы по медиане
+    p_min = price[g_starts]
+    p_max = price[g_starts + g_sizes - 1]
+    q1, median, q2 = (sorted_group_quantile(price, g_starts, g_sizes, q) for q in (1 / 3, 0.5, 2 / 3))
+    three_groups = (p_min < q1) & (q1 < q2) & (q2 < p_max)
+    two_groups = ~three_groups & (p_min < median) & (median < p_max)
+    valid = three_groups | two_groups
+    groups = groups[valid]
+    if len(groups) == 0:
+        return pd.DataFrame()
+    low_edge = np.where(three_groups, q1, median)[valid]
+    high_edge = np.where(three_groups, q2, median)[valid]
+
+    # Номер анализируемой модели для каждой строки (-1 - модель пропускается)
+    group_pos = np.full(len(models), -1)
+    group_pos[groups] = np.arange(len(groups))
+    row_group = group_pos[codes]
+    in_group = row_group >= 0
+    row_group, price, qty, sums = row_group[in_group], price[in_group], qty[in_group], sums[in_group]
+
+    # Низкая группа - цены до нижней границы включительно (интервалы закрыты справа, как у qcut), высокая - выше верхней.
+    # Внутри отрезка модели цены отсортированы, поэтому группы - префикс и суффикс отрезка:
+    # достаточно их длин, а суммы берутся разностями накопленных сумм без масочных копий
+    n_groups = len(groups)
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(row_group, minlength=n_groups))))
+    seg_start, seg_end = bounds[:-1], bounds[1:]
+    n_low = np.bincount(row_group, weights=price <= low_edge[row_group], minlength=n_groups).astype(np.int64)
+    n_high = np.bincount(row_group, weights=price > high_edge[row_group], minlength=n_groups).astype(np.int64)
+
+    def range_sum(values, lo, hi):
+        cumulative = np.concatenate(([0.0], np.cumsum(values)))
+        return cumulative[hi] - cumulative[lo]
+
+    low_price = range_sum(price, seg_start, seg_start + n_low) / n_low
+    high_price = range_sum(price, seg_end - n_high, seg_end) / n_high
+    low_qty = range_sum(qty, seg_start, seg_start + n_low)
+    high_qty = range_sum(qty, seg_end - n_high, seg_end)
+
+    # Простой расчет эластичности между крайними группами
+    price_change_pct = (high_price - low_price) / low_price * 100
+    qty_change_pct = (high_qty - low_qty) / low_qty * 100
+    elasticity = qty_change_pct / price_change_pct
+
+    # Классификация эластичности
+    abs_elasticity = np.abs(elasticity)
+    type_codes = np.select([abs_elasticity > 1, abs_elasticity < 1], [0, 1], 2)
+
+    return pd.DataFrame({
+        'Model': models[groups],
+        'Elasticity': elasticity,
+        'Type': pd.Categorical.from_codes(type_codes, categories=ELASTICITY_TYPES),
+        'Avg_Price': range_sum(price, seg_start, seg_end) / sizes[groups],
+        'Total_Revenue': range_sum(sums, seg_start, seg_end),
+        'Total_Qty': range_sum(qty, seg_start, seg_end),
+        'Price_Change_%': price_change_pct,
+        'Qty_Change_%': qty_change_pct,
+        'Recommendation': pd.Categorical.from_codes(type_codes, categories=ELASTICITY_RECS)
+    })
+
+def top_n_positions(values, n):
+    """Позиции n наибольших значений по убыванию: argpartition и сортировка только отобранных"""
+    values = np.asarray(values, dtype=float)
+    if n < len(values):
+        positions = np.argpartition(-values, n - 1)[:n]
+    else:
+        positions = np.arange(len(values))
+    return positions[np.argsort(-values[positions], kind='stable')]
+
+def aggregate_models(df, split_date):
+    """Итоги по моделям за один проход bincount: продажи, выручка и продажи начиная с split_date"""
+    codes, models = model_codes(df)
+    # Строки без модели (код -1) в итоги не входят, как и в groupby
+    if (codes < 0).any():
+        df = df[codes >= 0]
+        codes = codes[codes >= 0]
+
+    n_models = len(models)
+    qty = df['Qty'].to_numpy(dtype=float)
+    late = df['Datasales'].to_numpy() >= split_date.to_datetime64()
+    # Категории общие для всего датасета: модели без продаж в выборке отбрасываются, как при observed=True
+    present = np.bincount(codes, minlength=n_models) > 0
+
+    return pd.DataFrame({
+        'Qty': np.bincount(codes, weights=qty, minlength=n_models)[present],
+        'Sum': np.bincount(codes, weights=df['Sum'].to_numpy(dtype=float), minlength=n_models)[present],
+        'Period2_Qty': np.bincount(codes[late], weights=qty[late], minlength=n_models)[present]
+    }, index=pd.Index(np.asarray(models)[present], name='Model'))
+
+@st.cache_data(show_spinner=False)
+def compute_marketing(selection_key, _filtered_df, period_start, period_end):
+    """ABC-анализ и тренд по моделям для маркетингового блока (кэшируется)"""
+    # Середина периода делит продажи на 2 периода для сравнения
+    mid_date = period_start + (period_end - period_start) / 2
+
+    # Одна агрегация по моделям на ABC и тренд
+    agg_model = aggregate_models(_filtered_df, mid_date)
+
+    # ABC анализ товаров: сортировка и накопленная доля на массивах float64
+    sums = agg_model['Sum'].to_numpy(dtype=float)
+    order = np.argsort(-sums, kind='stable')
+    sums_sorted = sums[order]
+    cum_revenue = np.cumsum(sums_sorted)
+    cum_pct = cum_revenue / sums_sorted.sum() * 100
+
+    # Классификация ABC: индекс полосы по накопленной доле через np.searchsorted
+    abc_codes = np.searchsorted(ABC_BANDS, cum_pct, side='left')
+
+    # Таблица с подписями моделей собирается только для отображения
+    product_analysis = pd.DataFrame({
+        'Model': agg_model.index[order],
+        'Qty': agg_model['Qty'].to_numpy()[order],
+        'Sum': sums_sorted,
+        'Cumulative_Revenue': cum_revenue,
+        'Cumulative_Percent': cum_pct,
+        'Category': pd.Categorical.from_codes(abc_codes, categories=ABC_CATEGORIES)
+    })
+
+    # Сводная таблица по категориям: два прохода bincount по кодам A/B/C,
+    # пустые категории не показываются
+    abc_counts = np.bincount(abc_codes, minlength=len(ABC_CATEGORIES))
+    abc_revenue = np.bincount(abc_codes, weights=sums_sorted, minlength=len(ABC_CATEGORIES))
+    present = abc_counts > 0
+    abc_summary = pd.DataFrame({
+        'Категория': np.array(ABC_LABELS)[present],
+        'Кількість позиций': abc_counts[present],
+        'Доход (ГРН)': abc_revenue[present]
+    })
+
+    # Добавляем процент от общего дохода
+    abc_summary['Доля от общего дохода %'] = (abc_revenue[present] / abc_revenue.sum() * 100).round(2)
+
+    # Среднее число уникальных товаров в день (для условного conversion rate):
+    # уникальные пары (дата, товар) по целочисленным кодам вместо groupby().nunique()
+    date_codes, dates = pd.factorize(_filtered_df['Datasales'], sort=False)
+    art_codes, arts = pd.factorize(_filtered_df['Art'], sort=False)
+    has_art = art_codes >= 0
+    day_art_pairs = np.unique(date_codes[has_art].astype(np.int64) * len(arts) + art_codes[has_art])
+    daily_products = len(day_art_pairs) / len(dates)
+
+    # Продажи второго периода уже в agg_model, первый период = итог минус второй
+    sales_period2 = agg_model['Period2_Qty']
+    sales_period1 = agg_model['Qty'] - sales_period2
+
+    # Расчет изменения (общие продажи берутся из agg_model)
+    trend_data = pd.DataFrame({
+        'Model': agg_model.index,
+        'Total_Qty': agg_model['Qty'].values,
+        'Total_Revenue': agg_model['Sum'].values,
+        'Period1_Qty': sales_period1.values,
+        'Period2_Qty': sales_period2.values
+    })
+
+    # Расчет процента изменения (один массив, умножение на месте)
+    p1 = trend_data['Period1_Qty'].to_numpy(dtype=float)
+    p2 = trend_data['Period2_Qty'].to_numpy(dtype=float)
+    change_pct = safe_divide(p2 - p1, p1)
+    change_pct *= 100
+    trend_data['Change_%'] = change_pct
+
+    # Стабильность (чем меньше изменение, тем стабильнее)
+    trend_data['Stability_Score'] = 100 - np.minimum(np.abs(change_pct), 100)
+
+    # ТОП-20 по выручке - частичный отбор вместо сортировки всех моделей
+    model_revenue = trend_data['Total_Revenue'].to_numpy()
+    revenue_rank = top_n_positions(model_revenue, 20)
+
+    # Сводка для маркетинговых метрик: доли лидеров и число растущих/падающих моделей
+    total_revenue_all = model_revenue.sum()
+    # Падение - ниже -20%, рост - выше 20%, остальное (отрезок [-20, 20]) - стабильно
+    declining_count = np.count_nonzero(change_pct < -20)
+    growing_count = np.count_nonzero(change_pct > 20)
+    stable_count = len(change_pct) - declining_count - growing_count
+    trend_summary = {
+        'total_revenue_all': total_revenue_all,
+        'top_5_share': model_revenue[revenue_rank[:5]].sum() / total_revenue_all * 100,
+        'top_10_share': model_revenue[revenue_rank[:10]].sum() / total_revenue_all * 100,
+        'declining_count': int(declining_count),
+        'growing_count': int(growing_count),
+        'stable_count': int(stable_count)
+    }
+
+    return {
+        'product_analysis': product_analysis,
+        'abc_summary': abc_summary,
+        'daily_products': daily_products,
+        'trend_data': trend_data,
+        'revenue_rank': revenue_rank,
+        'trend_summary': trend_summary
+    }
+
+@st.cache_data(show_spinner=False)
+def build_insights(recent_sales, older_sales, daily_sales, avg_forecast):
+    """Формирует инсайты и проблемы по уже посчитанным показателям (кэшируется)"""
     insights = []
     problems = []
     
-    if len(filtered) == 0:
-        return insights, problems
-    
     # Анализ тренда
-    recent_sales = filtered.tail(30)['Qty'].sum()
-    older_sales = filtered.head(30)['Qty'].sum()
-    
     if recent_sales > older_sales * 1.2:
         insights.append("📈 Продажи растут! Рекомендуется увеличить закупки.")
     elif recent_sales < older_sales * 0.8:
@@ -1280,17 +1837,15 @@ def generate_insights(df, forecast, magazin, segment):
         insights.append("🔍 Рассмотрите проведение промо-акций.")
     
     # Анализ волатильности
-    daily_sales = filtered.groupby('Datasales')['Qty'].sum()
-    cv = daily_sales.std() / daily_sales.mean() if daily_sales.mean() > 0 else 0
+    daily_mean = daily_sales.mean()
+    cv = daily_sales.std(ddof=1) / daily_mean if daily_mean > 0 else 0
     
     if cv > 0.5:
         problems.append("⚠️ Высокая волатильность продажів. Сложно планировать запасы.")
         insights.append("📦 Рекомендуется создать буферный запас.")
     
     # Анализ прогноза
-    future_forecast = forecast.tail(30)
-    avg_forecast = future_forecast['yhat'].mean()
-    historical_avg = daily_sales.tail(30).mean()
+    historical_avg = daily_sales[-30:].mean()
     
     if avg_forecast > historical_avg * 1.1:
         insights.append("🚀 Прогноз показывает рост продажів. Подготовьте дополнительные запасы.")
@@ -1299,7 +1854,24 @@ def generate_insights(df, forecast, magazin, segment):
     
     return insights, problems
 
-def create_word_report(detailed_forecast, selected_magazin, selected_segment, forecast_days, 
+def generate_insights(filtered_df, daily_grid, forecast, magazin, segment):
+    """Генерирует инсайты и рекомендации для конкретного магазина и сегмента"""
+    if magazin == 'Всі магазини' or segment == 'Всі сегменти' or len(filtered_df) == 0:
+        return [], []
+    
+    qty = filtered_df['Qty'].to_numpy(dtype=float)
+    daily_sales = select_daily_qty(daily_grid, magazin, segment).to_numpy(dtype=float)
+    avg_forecast = float(forecast['yhat'].tail(30).mean())
+    
+    return build_insights(float(qty[-30:].sum()), float(qty[:30].sum()), daily_sales, avg_forecast)
+
+@st.cache_data(show_spinner=False)
+def forecast_csv_bytes(forecast_key, _detailed_forecast, selected_magazin, selected_segment):
+    """CSV детального прогноза с колонками магазина и сегмента (кэшируется)"""
+    export_data = _detailed_forecast.assign(**{'Магазин': selected_magazin, 'Сегмент': selected_segment})
+    return export_data.to_csv(index=False).encode('utf-8')
+
+def create_word_report(forecast_rows, selected_magazin, selected_segment, forecast_days, 
                       total_forecast, avg_daily_forecast, forecast_revenue, confidence_score,
                       accuracy_metrics, insights, filtered_df, prophet_data):
     """Создает Word отчет с результатами прогнозирования"""
@@ -1400,11 +1972,13 @@ def create_word_report(detailed_forecast, selected_magazin, selected_segment, fo
         forecast_table.rows[0].cells[2].text = 'Реальный'
         forecast_table.rows[0].cells[3].text = 'Оптимистичный'
         
-        for i, (idx, row) in enumerate(detailed_forecast.head(10).iterrows(), 1):
-            forecast_table.rows[i].cells[0].text = row['📅 Дата']
-            forecast_table.rows[i].cells[1].text = str(row['😰 Песимістичний'])
-            forecast_table.rows[i].cells[2].text = str(row['🎯 Реальний'])
-            forecast_table.rows[i].cells[3].text = str(row['🚀 Оптимістичний'])
+        # forecast_rows: массивы (даты, песимистичный, реальный, оптимистичный) по первым 10 дням
+        for i, (date, pessimistic, realistic, optimistic) in enumerate(zip(*forecast_rows), 1):
+            row_cells = forecast_table.rows[i].cells
+            row_cells[0].text = date
+            row_cells[1].text = str(pessimistic)
+            row_cells[2].text = str(realistic)
+            row_cells[3].text = str(optimistic)
         
         doc.add_page_break()
         
@@ -1412,16 +1986,18 @@ def create_word_report(detailed_forecast, selected_magazin, selected_segment, fo
         doc.add_heading('Статистика исторических данных', level=1)
         
         total_sales = filtered_df['Qty'].sum()
-        total_revenue = filtered_df['Sum'].sum()
+        total_revenue = filtered_df['Sum'].to_numpy(dtype=np.float64).sum()
         avg_price = total_revenue / total_sales if total_sales > 0 else 0
-        period_days = (filtered_df['Datasales'].max() - filtered_df['Datasales'].min()).days + 1
+        sale_dates = filtered_df['Datasales'].to_numpy()
+        period_start, period_end = pd.Timestamp(sale_dates.min()), pd.Timestamp(sale_dates.max())
+        period_days = (period_end - period_start).days + 1
         
         stats_table = doc.add_table(rows=10, cols=2)
         stats_table.style = 'Light Grid Accent 1'
         
         stats_data = [
             ('Показатель', 'Значение'),
-            ('Период данных', f"{filtered_df['Datasales'].min().strftime('%Y-%m-%d')} - {filtered_df['Datasales'].max().strftime('%Y-%m-%d')}"),
+            ('Период данных', f"{period_start.strftime('%Y-%m-%d')} - {period_end.strftime('%Y-%m-%d')}"),
             ('Всего дней', f'{period_days}'),
             ('Всего продано', f'{total_sales:.0f} одиниць'),
             ('Общая выручка', f'{total_revenue:.0f} ГРН'),
@@ -1442,7 +2018,7 @@ def create_word_report(detailed_forecast, selected_magazin, selected_segment, fo
         
         for i, insight in enumerate(insights[:15], 1):
             # Удаляем эмодзи
-            clean_insight = insight.replace('🎯', '').replace('📊', '').replace('🚀', '').replace('⚡', '').replace('📦', '').replace('🔍', '').replace('📈', '').replace('💡', '').replace('🔥', '').strip()
+            clean_insight = EMOJI_RE.sub('', insight).strip()
             p = doc.add_paragraph(f'{i}. {clean_insight}')
             p.style = 'List Number'
         
@@ -1452,7 +2028,7 @@ def create_word_report(detailed_forecast, selected_magazin, selected_segment, fo
         doc.add_heading('Заключение', level=1)
         
         conclusion_text = f"""
-Данный прогноз основан на анализе исторических данных продажів за период с {filtered_df['Datasales'].min().strftime('%Y-%m-%d')} по {filtered_df['Datasales'].max().strftime('%Y-%m-%d')}.
+Данный прогноз основан на анализе исторических данных продажів за период с {period_start.strftime('%Y-%m-%d')} по {period_end.strftime('%Y-%m-%d')}.
 
 Модель показывает уверенность прогноза на уровне {confidence_score:.0f}%, что {"говорит о высокой надежности" if confidence_score > 70 else "требует осторожного применения"} результатов для планирования.
 
@@ -1467,18 +2043,194 @@ def create_word_report(detailed_forecast, selected_magazin, selected_segment, fo
         footer.add_run(f'Отчет сгенерирован: {datetime.now().strftime("%Y-%m-%d %H:%M")}').italic = True
         footer.alignment = WD_ALIGN_PARAGRAPH.CENTER
         
-        # Сохранение в BytesIO
+        # Сохранение в BytesIO (st.download_button принимает буфер напрямую)
         buffer = BytesIO()
         doc.save(buffer)
         buffer.seek(0)
         
-        return buffer.getvalue()
+        return buffer
         
     except Exception as e:
         st.error(f"Ошибка при создании Word документа: {str(e)}")
         st.info("Встановіть бібліотеку: pip install python-docx")
         return None
 
+def show_top_best(trend_data, revenue_rank):
+    """Вкладка ТОП-20 моделей по выручке: график, таблица и инсайты"""
+    st.markdown("#### 🏆 ТОП-20 моделей по выручке")
+    
+    top_20_best = trend_data.iloc[revenue_rank]
+    top_20_best = top_20_best.assign(Avg_Price=top_20_best['Total_Revenue'] / top_20_best['Total_Qty'])
+    
+    # График
+    fig_best = plot_top_hbar(
+        top_20_best['Model'], top_20_best['Total_Revenue'],
+        "ТОП-20 моделей по выручке", "Выручка (ГРН)", 'Greens',
+        '{:.0f}', 'Выручка: %{x:.0f} ГРН'
+    )
+    
+    st.plotly_chart(fig_best, key="top20_best")
+    
+    # Таблица
+    st.markdown("##### 📋 Детальная информация")
+    
+    display_best = top_20_best[['Model', 'Total_Qty', 'Total_Revenue', 'Avg_Price', 'Change_%']].reset_index(drop=True)
+    display_best.index = display_best.index + 1
+    display_best = display_best.rename(columns={
+        'Model': '🏷️ Модель',
+        'Total_Qty': '📦 Продано',
+        'Total_Revenue': '💰 Выручка (ГРН)',
+        'Avg_Price': '💵 Средняя цена',
+        'Change_%': '📈 Изменение %'
+    })
+    
+    st.dataframe(
+        style_table(display_best, {
+            '📦 Продано': '{:.0f}',
+            '💰 Выручка (ГРН)': '{:.0f}',
+            '💵 Средняя цена': '{:.2f}',
+            '📈 Изменение %': '{:+.1f}%'
+        }, [
+            dict(subset=['💰 Выручка (ГРН)'], cmap='Greens'),
+            dict(subset=['📈 Изменение %'], cmap='RdYlGn', vmin=-50, vmax=50)
+        ]),
+        use_container_width=True
+    )
+    
+    # Инсайты
+    leader = top_20_best.iloc[0]
+    st.success(f"💎 **Лидер продажів**: {leader['Model']} - выручка {leader['Total_Revenue']:.0f} ГРН")
+    
+    growth_products = top_20_best[top_20_best['Change_%'] > 20]
+    if len(growth_products) > 0:
+        st.info(f"🚀 **Растущие хиты**: {len(growth_products)} товаров показывают рост более 20%")
+
+def show_top_stable(trend_data):
+    """Вкладка ТОП-20 самых стабильных моделей"""
+    st.markdown("#### 📊 ТОП-20 самых стабильных моделей")
+    st.caption("Товары с минимальными колебаниями продажів между периодами")
+    
+    # Только товары, которые продавались в обоих периодах: отбор по позициям в массивах,
+    # из trend_data материализуются лишь 20 итоговых строк
+    candidates = np.flatnonzero((trend_data['Period1_Qty'].to_numpy() > 0) & (trend_data['Period2_Qty'].to_numpy() > 0))
+    stability = trend_data['Stability_Score'].to_numpy()[candidates]
+    top_20_stable = trend_data.iloc[candidates[top_n_positions(stability, 20)]]
+    top_20_stable = top_20_stable.assign(Avg_Price=top_20_stable['Total_Revenue'] / top_20_stable['Total_Qty'])
+    
+    # График
+    fig_stable = plot_top_hbar(
+        top_20_stable['Model'], top_20_stable['Stability_Score'],
+        "ТОП-20 самых стабильных моделей", "Индекс стабильности (%)", 'Blues',
+        '{:.1f}', 'Стабильность: %{x:.1f}%'
+    )
+    
+    st.plotly_chart(fig_stable, key="top20_stable")
+    
+    # Таблица
+    st.markdown("##### 📋 Детальная информация")
+    
+    display_stable = top_20_stable[['Model', 'Total_Qty', 'Total_Revenue', 'Avg_Price', 'Change_%', 'Stability_Score']].reset_index(drop=True)
+    display_stable.index = display_stable.index + 1
+    display_stable = display_stable.rename(columns={
+        'Model': '🏷️ Модель',
+        'Total_Qty': '📦 Продано',
+        'Total_Revenue': '💰 Выручка (ГРН)',
+        'Avg_Price': '💵 Средняя цена',
+        'Change_%': '📈 Изменение %',
+        'Stability_Score': '📊 Стабильность %'
+    })
+    
+    st.dataframe(
+        style_table(display_stable, {
+            '📦 Продано': '{:.0f}',
+            '💰 Выручка (ГРН)': '{:.0f}',
+            '💵 Средняя цена': '{:.2f}',
+            '📈 Изменение %': '{:+.1f}%',
+            '📊 Стабильность %': '{:.1f}%'
+        }, [
+            dict(subset=['📊 Стабильность %'], cmap='Blues')
+        ]),
+        use_container_width=True
+    )
+    
+    # Инсайты
+    leader = top_20_stable.iloc[0]
+    st.success(f"🎯 **Самый стабильный**: {leader['Model']} - стабильность {leader['Stability_Score']:.1f}%")
+    st.info(f"💡 **Рекомендація**: Стабильные товары идеальны для постоянного наличия на складе")
+
+def show_top_declining(trend_data, celebrate=True):
+    """Вкладка ТОП-20 моделей с наибольшим падением продаж"""
+    st.markdown("#### 📉 ТОП-20 моделей с наибольшим падением")
+    st.caption("Товары, показывающие снижение продажів")
+    
+    # Только товары с падением: отбор по позициям в массиве Change_% без копии отфильтрованной таблицы
+    change_pct = trend_data['Change_%'].to_numpy()
+    candidates = np.flatnonzero(change_pct < 0)
+    
+    if len(candidates) > 0:
+        top_20_declining = trend_data.iloc[candidates[top_n_positions(-change_pct[candidates], 20)]]
+    
+        # График
+        fig_decline = plot_top_hbar(
+            top_20_declining['Model'], top_20_declining['Change_%'],
+            "ТОП-20 моделей с наибольшим падением продажів", "Изменение (%)", 'Reds_r',
+            '{:.1f}%', 'Падение: %{x:.1f}%', categoryorder='total descending'
+        )
+    
+        st.plotly_chart(fig_decline, key="top20_decline")
+    
+        # Таблица
+        st.markdown("##### 📋 Детальная информация")
+    
+        display_decline = top_20_declining[['Model', 'Total_Qty', 'Total_Revenue', 'Period1_Qty', 'Period2_Qty', 'Change_%']].reset_index(drop=True)
+        display_decline.index = display_decline.index + 1
+        display_decline = display_decline.rename(columns={
+            'Model': '🏷️ Модель',
+            'Total_Qty': '📦 Всего продано',
+            'Total_Revenue': '💰 Выручка (ГРН)',
+            'Period1_Qty': '📊 1-й период',
+            'Period2_Qty': '📊 2-й период',
+            'Change_%': '📉 Падение %'
+        })
+    
+        st.dataframe(
+            style_table(display_decline, {
+                '📦 Всего продано': '{:.0f}',
+                '💰 Выручка (ГРН)': '{:.0f}',
+                '📊 1-й период': '{:.0f}',
+                '📊 2-й период': '{:.0f}',
+                '📉 Падение %': '{:.1f}%'
+            }, [
+                dict(subset=['📉 Падение %'], cmap='Reds_r')
+            ]),
+            use_container_width=True
+        )
+    
+        # Алерты и рекомендации
+        critical_count = int((top_20_declining['Change_%'].to_numpy() < -50).sum())
+    
+        if critical_count > 0:
+            st.error(f"🚨 **КРИТИЧНО**: {critical_count} товаров с падением более 50%!")
+    
+        worst = top_20_declining.iloc[0]
+        st.warning(f"⚠️ **Проблемный товар**: {worst['Model']} - падение {worst['Change_%']:.1f}%")
+    
+        st.markdown("##### 💡 Рекомендации по проблемным товарам:")
+        recommendations = [
+            "🎯 Провести анализ причин падения (конкуренция, цена, актуальность)",
+            "🔥 Запустить промо-акции со скидками 20-30%",
+            "📢 Усилить маркетинг и рекламу",
+            "💡 Рассмотреть обновление ассортимента или замену товара",
+            "📦 Снизить закупки до стабилизации ситуации"
+        ]
+    
+        render_cards(recommendations)
+    
+    else:
+        st.success("✅ Отличные новости! Нет товаров с падением продажів")
+        if celebrate:
+            st.balloons()
+
 def main():
     st.markdown('<h1 class="main-header">🏪 Система прогнозування продажів</h1>', unsafe_allow_html=True)
     
@@ -1599,7 +2351,10 @@ def main():
             """)
         return
     
-    show_data_statistics(df)
+    # Ключ содержимого вычислен при загрузке; функции над всем df кэшируются по нему, не хэшируя таблицу заново
+    data_key = df.attrs.get('data_key') or hash_dataframe(df)
+    daily_grid = aggregate_daily_qty(data_key, df)
+    show_data_statistics(df, daily_grid)
     
     st.markdown("---")
     st.markdown("## 🎯 Вибір параметрів аналізу")
@@ -1619,22 +2374,38 @@ def main():
         
         selected_segment = st.selectbox("📂 Оберіть сегмент", available_segments)
     
-    if st.button("🚀 Створити прогноз", type="primary", use_container_width=True):
-        with st.spinner("🔄 Навчання моделі..."):
-            filtered_df = df.copy()
-            
-            if selected_magazin != 'Всі магазини':
-                filtered_df = filtered_df[filtered_df['Magazin'] == selected_magazin]
-            
-            if selected_segment != 'Всі сегменти':
-                filtered_df = filtered_df[filtered_df['Segment'] == selected_segment]
-            
-            if len(filtered_df) < 10:
+    # Параметры построенного отчета хранятся в session_state: перезапуск от виджетов внутри отчета
+    # (переключатель эластичности) не сбрасывает его, пока параметры анализа не изменились
+    report_params = (data_key, selected_magazin, selected_segment, forecast_days, remove_outliers, smooth_method, smooth_window)
+    # Ключи кэша отчета: выборка (данные, магазин, сегмент) и она же с параметрами предобработки для Prophet.
+    # Кэшируемые функции получают таблицы в параметрах с "_" и не хэшируют их на каждом перезапуске
+    selection_key = (data_key, selected_magazin, selected_segment)
+    prophet_key = selection_key + (remove_outliers, smooth_method, smooth_window)
+    
+    # first_build - прогон, запущенный самой кнопкой: только в нем показываются спиннер обучения и конфетти
+    first_build = st.button("🚀 Створити прогноз", type="primary", use_container_width=True)
+    if first_build:
+        st.session_state.report_params = report_params
+    
+    if st.session_state.get('report_params') == report_params:
+        with (st.spinner("🔄 Навчання моделі...") if first_build else contextlib.nullcontext()):
+            filtered_df = filter_sales(data_key, df, selected_magazin, selected_segment)
+            daily_qty = select_daily_qty(daily_grid, selected_magazin, selected_segment)
+            n_rows = len(filtered_df)
+
+            if n_rows < 10:
                 st.error("❌ Недостатньо даних для прогнозування (мінімум 10 записей)")
                 return
             
+            # Итоги выборки считаются один раз и переиспользуются во всех блоках ниже
+            qty_total = filtered_df['Qty'].sum()
+            revenue_total = filtered_df['Sum'].to_numpy(dtype=np.float64).sum()
+            sale_dates = filtered_df['Datasales'].to_numpy()
+            period_start, period_end = pd.Timestamp(sale_dates.min()), pd.Timestamp(sale_dates.max())
+            data_days = (period_end - period_start).days
+            
             prophet_data, original_data = prepare_prophet_data(
-                filtered_df, 
+                selection_key, daily_qty, 
                 remove_outliers=remove_outliers, 
                 smooth_method=smooth_method if smooth_method != 'none' else None,
                 smooth_window=smooth_window
@@ -1663,16 +2434,18 @@ def main():
                              delta=f"{volatility_after - volatility_before:.1f}%")
                 
                 fig_preprocessing = plot_data_preprocessing(original_data, prophet_data, "🔄 Сравнение: Оригинальные vs Обработанные данные")
-                st.plotly_chart(fig_preprocessing, use_container_width=True, key="preprocessing")
+                st.plotly_chart(fig_preprocessing, key="preprocessing")
             
-            model, forecast = train_prophet_model(prophet_data, periods=forecast_days)
+            model, forecast = train_prophet_model(prophet_key, prophet_data, periods=forecast_days)
             
             if model is None or forecast is None:
                 return
             
             st.success("✅ Модель успешно обучена!")
             
-            accuracy_metrics = calculate_model_accuracy(prophet_data, model)
+            accuracy_metrics = calculate_model_accuracy(prophet_key, prophet_data)
+            # MAPE нужен в нескольких блоках выводов; None - метрики недоступны
+            mape = accuracy_metrics['MAPE'] if accuracy_metrics else None
             if accuracy_metrics:
                 show_accuracy_table(accuracy_metrics)
             
@@ -1685,47 +2458,39 @@ def main():
                 forecast, 
                 f"Прогноз продажів - {selected_magazin} / {selected_segment}"
             )
-            st.plotly_chart(fig_main, use_container_width=True, key="main_forecast")
+            st.plotly_chart(fig_main, key="main_forecast")
             
             # Добавляем месячный анализ сразу после прогноза
             st.markdown("## 📊 Анализ по месяцам с прогнозом выручки")
             plot_monthly_analysis_with_forecast(
-                df, selected_magazin, selected_segment, model, 
+                data_key, df, selected_magazin, selected_segment, prophet_key, prophet_data, 
                 forecast_days, remove_outliers, smooth_method if smooth_method != 'none' else None
             )
             
             st.markdown("## 🔍 Детальный анализ")
             
-            fig_components = plot_prophet_components(model, forecast)
-            st.plotly_chart(fig_components, use_container_width=True, key="prophet_components")
+            # История + будущее с тем же ограничением снизу, что и прогноз: для компонент и окна инсайтов
+            full_forecast = pd.concat(
+                [clip_forecast(predict_history(prophet_key, prophet_data)), forecast], ignore_index=True
+            )
+            fig_components = plot_prophet_components(model, full_forecast)
+            st.plotly_chart(fig_components, key="prophet_components")
             
             # === АНАЛИЗ ДНЯ НЕДЕЛИ ===
             st.markdown("### 📅 Анализ продажів по дням недели")
             
-            # Подготовка данных по дням недели
-            filtered_df_weekday = filtered_df.copy()
-            filtered_df_weekday['Weekday'] = filtered_df_weekday['Datasales'].dt.dayofweek
-            filtered_df_weekday['Weekday_Name'] = filtered_df_weekday['Datasales'].dt.day_name()
-            
-            # Переводим названия дней
-            weekday_translation = {
-                'Monday': 'Понедельник',
-                'Tuesday': 'Вторник',
-                'Wednesday': 'Среда',
-                'Thursday': 'Четверг',
-                'Friday': 'Пятница',
-                'Saturday': 'Суббота',
-                'Sunday': 'Воскресенье'
-            }
-            filtered_df_weekday['Weekday_Name_RU'] = filtered_df_weekday['Weekday_Name'].map(weekday_translation)
-            
-            weekday_stats = filtered_df_weekday.groupby(['Weekday', 'Weekday_Name_RU']).agg({
-                'Qty': 'sum',
-                'Sum': 'sum'
-            }).reset_index().sort_values('Weekday')
-            
-            weekday_stats['Avg_Price'] = weekday_stats['Sum'] / weekday_stats['Qty']
-            weekday_stats['Qty_Percent'] = (weekday_stats['Qty'] / weekday_stats['Qty'].sum() * 100)
+            # Подготовка данных по дням недели (вместе с тепловой картой)
+            weekday_stats, heatmap_pivot = weekday_aggregates(filtered_df)
+            
+            # Массивы и их статистики берутся один раз для всех графиков и выводов блока
+            weekday_qty_arr = weekday_stats['Qty'].to_numpy()
+            weekday_sum_arr = weekday_stats['Sum'].to_numpy()
+            weekday_names_arr = weekday_stats['Weekday_Name_RU'].to_numpy()
+            best_idx, worst_idx = weekday_qty_arr.argmax(), weekday_qty_arr.argmin()
+            best_revenue_idx = weekday_sum_arr.argmax()
+            
+            weekday_stats['Avg_Price'] = weekday_sum_arr / weekday_qty_arr
+            weekday_stats['Qty_Percent'] = weekday_qty_arr / weekday_qty_arr.sum() * 100
             
             col1, col2 = st.columns(2)
             
@@ -1733,8 +2498,7 @@ def main():
                 # График продажів по дням недели
                 fig_weekday1 = go.Figure()
                 
-                colors = ['#ff6b6b' if qty == weekday_stats['Qty'].max() else '#1f77b4' 
-                         for qty in weekday_stats['Qty']]
+                colors = np.where(weekday_qty_arr == weekday_qty_arr[best_idx], '#ff6b6b', '#1f77b4')
                 
                 fig_weekday1.add_trace(go.Bar(
                     x=weekday_stats['Weekday_Name_RU'],
@@ -1755,13 +2519,13 @@ def main():
                     showlegend=False
                 )
                 
-                st.plotly_chart(fig_weekday1, use_container_width=True, key="weekday_sales")
+                st.plotly_chart(fig_weekday1, key="weekday_sales")
                 
                 # Находим лучший и худший день
-                best_day = weekday_stats.loc[weekday_stats['Qty'].idxmax(), 'Weekday_Name_RU']
-                worst_day = weekday_stats.loc[weekday_stats['Qty'].idxmin(), 'Weekday_Name_RU']
-                best_qty = weekday_stats['Qty'].max()
-                worst_qty = weekday_stats['Qty'].min()
+                best_day = weekday_names_arr[best_idx]
+                worst_day = weekday_names_arr[worst_idx]
+                best_qty = weekday_qty_arr[best_idx]
+                worst_qty = weekday_qty_arr[worst_idx]
                 
                 st.success(f"🏆 **Лучший день**: {best_day} ({best_qty:.0f} шт)")
                 st.error(f"📉 **Слабый день**: {worst_day} ({worst_qty:.0f} шт)")
@@ -1770,8 +2534,7 @@ def main():
                 # График выручки по дням недели
                 fig_weekday2 = go.Figure()
                 
-                colors_revenue = ['#2ecc71' if rev == weekday_stats['Sum'].max() else '#3498db' 
-                                 for rev in weekday_stats['Sum']]
+                colors_revenue = np.where(weekday_sum_arr == weekday_sum_arr[best_revenue_idx], '#2ecc71', '#3498db')
                 
                 fig_weekday2.add_trace(go.Bar(
                     x=weekday_stats['Weekday_Name_RU'],
@@ -1791,10 +2554,10 @@ def main():
                     showlegend=False
                 )
                 
-                st.plotly_chart(fig_weekday2, use_container_width=True, key="weekday_revenue")
+                st.plotly_chart(fig_weekday2, key="weekday_revenue")
                 
-                best_revenue_day = weekday_stats.loc[weekday_stats['Sum'].idxmax(), 'Weekday_Name_RU']
-                best_revenue = weekday_stats['Sum'].max()
+                best_revenue_day = weekday_names_arr[best_revenue_idx]
+                best_revenue = weekday_sum_arr[best_revenue_idx]
                 
                 st.success(f"💎 **Максимальная выручка**: {best_revenue_day} ({best_revenue:.0f} ГРН)")
             
@@ -1816,35 +2579,27 @@ def main():
                 showlegend=True
             )
             
-            st.plotly_chart(fig_pie, use_container_width=True, key="weekday_pie")
+            st.plotly_chart(fig_pie, key="weekday_pie")
             
             # Рекомендации по дням недели
             st.markdown("#### 💡 Рекомендации по дням недели:")
             
-            avg_qty = weekday_stats['Qty'].mean()
-            weak_days = weekday_stats[weekday_stats['Qty'] < avg_qty * 0.8]['Weekday_Name_RU'].tolist()
-            strong_days = weekday_stats[weekday_stats['Qty'] > avg_qty * 1.2]['Weekday_Name_RU'].tolist()
+            avg_qty = weekday_qty_arr.mean()
+            weak_days = weekday_names_arr[weekday_qty_arr < avg_qty * 0.8].tolist()
+            strong_days = weekday_names_arr[weekday_qty_arr > avg_qty * 1.2].tolist()
             
             if weak_days:
-                st.markdown(f'<div class="problem-card">📉 Слабые дни ({", ".join(weak_days)}): Проведите акции или скидки для стимулирования продажів</div>', unsafe_allow_html=True)
+                st.markdown(PROBLEM_CARD_TPL.format(body=f'📉 Слабые дни ({", ".join(weak_days)}): Проведите акции или скидки для стимулирования продажів'), unsafe_allow_html=True)
             
             if strong_days:
-                st.markdown(f'<div class="insight-card">🚀 Сильные дни ({", ".join(strong_days)}): Обеспечьте достаточный запас товаров и персонала</div>', unsafe_allow_html=True)
+                st.markdown(INSIGHT_CARD_TPL.format(body=f'🚀 Сильные дни ({", ".join(strong_days)}): Обеспечьте достаточный запас товаров и персонала'), unsafe_allow_html=True)
             
             # === ДОПОЛНИТЕЛЬНЫЕ ГРАФИКИ ===
             st.markdown("### 📊 Додаткова аналітика")
             
             # Тепловая карта продажів: день недели x неделя месяца
-            filtered_df_heatmap = filtered_df.copy()
-            filtered_df_heatmap['Week'] = filtered_df_heatmap['Datasales'].dt.isocalendar().week
-            filtered_df_heatmap['Weekday'] = filtered_df_heatmap['Datasales'].dt.dayofweek
-            
-            heatmap_data = filtered_df_heatmap.groupby(['Week', 'Weekday'])['Qty'].sum().reset_index()
-            heatmap_pivot = heatmap_data.pivot(index='Week', columns='Weekday', values='Qty').fillna(0)
-            
             # Названия дней для колонок
-            day_names = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-            heatmap_pivot.columns = [day_names[i] if i < len(day_names) else str(i) for i in heatmap_pivot.columns]
+            heatmap_pivot.columns = [WEEKDAY_SHORT_RU[i] for i in heatmap_pivot.columns]
             
             fig_heatmap = go.Figure(data=go.Heatmap(
                 z=heatmap_pivot.values,
@@ -1864,11 +2619,11 @@ def main():
                 height=500
             )
             
-            st.plotly_chart(fig_heatmap, use_container_width=True, key="sales_heatmap")
+            st.plotly_chart(fig_heatmap, key="sales_heatmap")
             
             st.markdown("## 🏆 Топ-10 моделей по сегментам")
             
-            segments_top_models = get_top_models_by_segment(df, selected_magazin)
+            segments_top_models = get_top_models_by_segment(data_key, df, selected_magazin)
             
             if segments_top_models:
                 tabs = st.tabs([f"📦 {segment}" for segment in segments_top_models.keys()])
@@ -1876,42 +2631,40 @@ def main():
                 for tab, (segment, top_models) in zip(tabs, segments_top_models.items()):
                     with tab:
                         if not top_models.empty:
-                            display_df = top_models[['Model', 'Qty', 'Sum', 'Price']].rename(columns={
-                                'Model': '🏷️ Модель',
-                                'Qty': '📦 Кількість',
-                                'Sum': '💰 Выручка (ГРН)',
-                                'Price': '💵 Средняя цена'
-                            })
-                            
-                            st.dataframe(display_df, use_container_width=True, hide_index=True)
+                            st.dataframe(top_models, use_container_width=True, hide_index=True)
                         else:
                             st.info("🔍 Нет данных для этого сегмента")
             
             st.markdown("## 💡 Инсайты и рекомендации")
             
-            insights, problems = generate_insights(df, forecast, selected_magazin, selected_segment)
+            insights, problems = generate_insights(filtered_df, daily_grid, full_forecast, selected_magazin, selected_segment)
             
             if problems:
                 st.markdown("### 🚨 Выявленные проблемы:")
-                for problem in problems:
-                    st.markdown(f'<div class="problem-card">{problem}</div>', unsafe_allow_html=True)
+                render_cards(problems, PROBLEM_CARD_TPL)
             
             st.markdown("### 🎯 Рекомендации:")
-            for insight in insights:
-                st.markdown(f'<div class="insight-card">{insight}</div>', unsafe_allow_html=True)
+            render_cards(insights)
             
             st.markdown("## 📋 Детальный прогноз по дням")
             
             forecast_display = forecast.tail(forecast_days).copy()
-            segment_volatility = calculate_segment_volatility(df, selected_magazin, selected_segment)
+            segment_volatility = calculate_segment_volatility(segment_volatility_table(data_key, df), selected_magazin, selected_segment)
             
             realistic, optimistic, pessimistic = get_forecast_scenarios(forecast_display, segment_volatility)
             
+            # Сценарии одним массивом (N, 3): песимистичный, реальный, оптимистичный
+            scen = np.ascontiguousarray(np.column_stack([pessimistic, realistic, optimistic]), dtype=np.float32)
+            scen_sums = scen.sum(axis=0)
+            scen_means = scen.mean(axis=0)
+            scen_int = np.rint(scen).astype(np.int32)
+            scen_int_means = scen_int.mean(axis=0)
+            
             detailed_forecast = pd.DataFrame({
                 '📅 Дата': pd.to_datetime(forecast_display['ds']).dt.strftime('%Y-%m-%d (%A)'),
-                '😰 Песимістичний': pessimistic.round(0).astype(int),
-                '🎯 Реальний': realistic.round(0).astype(int),
-                '🚀 Оптимістичний': optimistic.round(0).astype(int),
+                '😰 Песимістичний': scen_int[:, 0],
+                '🎯 Реальний': scen_int[:, 1],
+                '🚀 Оптимістичний': scen_int[:, 2],
                 '📊 Тренд': forecast_display['trend'].round(0).astype(int)
             })
             
@@ -1922,7 +2675,7 @@ def main():
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                avg_daily_forecast = realistic.mean()
+                avg_daily_forecast = scen_means[1]
                 st.metric(
                     "📊 Середні продажіві/день",
                     f"{avg_daily_forecast:.0f}",
@@ -1930,7 +2683,7 @@ def main():
                 )
             
             with col2:
-                total_forecast = realistic.sum()
+                total_forecast = scen_sums[1]
                 st.metric(
                     "📦 Загальний прогноз",
                     f"{total_forecast:.0f}",
@@ -1939,8 +2692,8 @@ def main():
             
             with col3:
                 # ИСПРАВЛЕНИЕ: безопасный расчет средней цены
-                if len(filtered_df) > 0 and filtered_df['Qty'].sum() > 0:
-                    avg_price = filtered_df['Sum'].sum() / filtered_df['Qty'].sum()
+                if n_rows > 0 and qty_total > 0:
+                    avg_price = revenue_total / qty_total
                 else:
                     avg_price = 0
                 
@@ -1964,27 +2717,26 @@ def main():
             st.markdown("## 🎓 Итоговые выводы и рекомендации")
             
             # Подготовка данных для анализа
-            total_sales = filtered_df['Qty'].sum()
-            total_revenue = filtered_df['Sum'].sum()
-            avg_daily_sales = filtered_df.groupby('Datasales')['Qty'].sum().mean()
+            total_sales = qty_total
+            total_revenue = revenue_total
+            avg_daily_sales = daily_qty.mean()
+            
+            # Тяжелые выборки по filtered_df берутся из кэша
+            conclusions_stats = compute_conclusions(selection_key, filtered_df, period_end)
             
             # Тренд последних 30 дней
-            last_30_days = filtered_df[filtered_df['Datasales'] >= filtered_df['Datasales'].max() - pd.Timedelta(days=30)]
-            trend_last_month = last_30_days['Qty'].sum()
+            trend_last_month = conclusions_stats['trend_last_month']
             
             # Прогноз
-            forecast_total = realistic.sum()
+            forecast_total = scen_sums[1]
             forecast_revenue = forecast_total * avg_price if avg_price > 0 else 0
             
             # Волатильность
             daily_volatility = prophet_data['y'].std() / prophet_data['y'].mean() if prophet_data['y'].mean() > 0 else 0
             
-            # День недели анализ
-            filtered_df_weekday = filtered_df.copy()
-            filtered_df_weekday['Weekday'] = filtered_df_weekday['Datasales'].dt.dayofweek
-            best_weekday = filtered_df_weekday.groupby('Weekday')['Qty'].sum().idxmax()
-            weekday_names = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
-            best_day_name = weekday_names[best_weekday]
+            # День недели анализ (weekday_stats уже посчитан выше)
+            best_weekday = int(weekday_stats['Weekday'].to_numpy()[best_idx])
+            best_day_name = WEEKDAY_NAMES_RU[best_weekday]
             
             # Создаем три колонки для выводов
             col1, col2, col3 = st.columns(3)
@@ -2019,8 +2771,7 @@ def main():
                 st.markdown("### ⚡ Статус модели")
                 
                 # Определяем качество модели
-                if accuracy_metrics:
-                    mape = accuracy_metrics['MAPE']
+                if mape is not None:
                     r2 = accuracy_metrics['R2']
                     
                     if mape < 10 and r2 > 0.8:
@@ -2089,23 +2840,24 @@ def main():
                 })
             
             # Анализ точности модели
-            if accuracy_metrics and accuracy_metrics['MAPE'] < 15:
-                conclusions.append({
-                    'emoji': '🎯',
-                    'title': 'Высокая точность прогноза',
-                    'text': f'MAPE {accuracy_metrics["MAPE"]:.1f}% говорит о высокой надежности прогноза. Можно уверенно использовать для планирования.',
-                    'type': 'success'
-                })
-            elif accuracy_metrics and accuracy_metrics['MAPE'] > 25:
-                conclusions.append({
-                    'emoji': '⚡',
-                    'title': 'Умеренная точность',
-                    'text': f'MAPE {accuracy_metrics["MAPE"]:.1f}% указывает на необходимость дополнительного анализа внешних факторов.',
-                    'type': 'warning'
-                })
+            if mape is not None:
+                if mape < 15:
+                    conclusions.append({
+                        'emoji': '🎯',
+                        'title': 'Высокая точность прогноза',
+                        'text': f'MAPE {mape:.1f}% говорит о высокой надежности прогноза. Можно уверенно использовать для планирования.',
+                        'type': 'success'
+                    })
+                elif mape > 25:
+                    conclusions.append({
+                        'emoji': '⚡',
+                        'title': 'Умеренная точность',
+                        'text': f'MAPE {mape:.1f}% указывает на необходимость дополнительного анализа внешних факторов.',
+                        'type': 'warning'
+                    })
             
             # Анализ дня недели
-            weekday_std = filtered_df_weekday.groupby('Weekday')['Qty'].sum().std()
+            weekday_std = weekday_qty_arr.std(ddof=1)
             if weekday_std > avg_daily_sales * 0.3:
                 conclusions.append({
                     'emoji': '📅',
@@ -2138,9 +2890,9 @@ def main():
             
             # Рекомендации по ценообразованию
             price_recommendations = []
-            if len(filtered_df) >= 30:
-                recent_price = filtered_df.tail(30)['Sum'].sum() / filtered_df.tail(30)['Qty'].sum() if filtered_df.tail(30)['Qty'].sum() > 0 else 0
-                older_price = filtered_df.head(30)['Sum'].sum() / filtered_df.head(30)['Qty'].sum() if filtered_df.head(30)['Qty'].sum() > 0 else 0
+            if conclusions_stats['recent_price'] is not None:
+                recent_price = conclusions_stats['recent_price']
+                older_price = conclusions_stats['older_price']
                 
                 if recent_price > older_price * 1.1:
                     price_recommendations.append("Цены растут - следите за реакцией спроса")
@@ -2165,8 +2917,7 @@ def main():
             else:
                 marketing_recommendations.append(f"Пик продажів в {best_day_name} - планируйте акции на этот день")
             
-            weak_days = filtered_df_weekday.groupby('Weekday')['Qty'].sum()
-            if weak_days.min() < weak_days.mean() * 0.7:
+            if weekday_qty_arr[worst_idx] < avg_qty * 0.7:
                 marketing_recommendations.append("Проводите акции «счастливые часы» в слабые дни недели")
             
             if forecast_growth < 0:
@@ -2228,35 +2979,18 @@ def main():
             
             # Расчет маркетинговых метрик
             # 1. Customer Lifetime Value (приблизительный)
-            avg_transaction = filtered_df['Sum'].sum() / len(filtered_df) if len(filtered_df) > 0 else 0
-            transactions_per_day = len(filtered_df) / ((filtered_df['Datasales'].max() - filtered_df['Datasales'].min()).days + 1)
-            
-            # 2. ABC анализ товаров
-            product_analysis = filtered_df.groupby('Model').agg({
-                'Qty': 'sum',
-                'Sum': 'sum'
-            }).reset_index()
-            product_analysis = product_analysis.sort_values('Sum', ascending=False)
-            product_analysis['Cumulative_Revenue'] = product_analysis['Sum'].cumsum()
-            product_analysis['Cumulative_Percent'] = (product_analysis['Cumulative_Revenue'] / product_analysis['Sum'].sum()) * 100
-            
-            # Классификация ABC
-            product_analysis['Category'] = 'C'
-            product_analysis.loc[product_analysis['Cumulative_Percent'] <= 80, 'Category'] = 'A'
-            product_analysis.loc[(product_analysis['Cumulative_Percent'] > 80) & (product_analysis['Cumulative_Percent'] <= 95), 'Category'] = 'B'
-            
-            # 3. Анализ жизненного цикла товара
-            first_sale = filtered_df.groupby('Model')['Datasales'].min()
-            last_sale = filtered_df.groupby('Model')['Datasales'].max()
-            product_lifecycle = pd.DataFrame({
-                'First_Sale': first_sale,
-                'Last_Sale': last_sale,
-                'Days_Active': (last_sale - first_sale).dt.days
-            })
+            avg_transaction = revenue_total / n_rows if n_rows else 0
+            transactions_per_day = n_rows / (data_days + 1)
+            
+            # ABC-анализ и тренд по моделям считаются в кэшируемой функции
+            marketing = compute_marketing(selection_key, filtered_df, period_start, period_end)
+            product_analysis = marketing['product_analysis']
+            trend_data = marketing['trend_data']
+            revenue_rank = marketing['revenue_rank']
             
             # 4. Conversion rate (условный - продажіви vs просмотры)
-            daily_products = filtered_df.groupby('Datasales')['Art'].nunique().mean()
-            daily_sales = filtered_df.groupby('Datasales')['Qty'].sum().mean()
+            daily_products = marketing['daily_products']
+            daily_sales = avg_daily_sales
             conversion_rate = (daily_sales / daily_products) if daily_products > 0 else 0
             
             col1, col2, col3, col4 = st.columns(4)
@@ -2293,35 +3027,16 @@ def main():
             # ABC Анализ - таблица по категориям
             st.markdown("### 📊 ABC-анализ товаров (Правило Парето)")
             
-            # Создаем сводную таблицу по категориям
-            abc_summary = product_analysis.groupby('Category').agg({
-                'Model': 'count',
-                'Sum': 'sum'
-            }).reset_index()
-            abc_summary.columns = ['Категория', 'Кількість позиций', 'Доход (ГРН)']
-            
-            # Добавляем процент от общего дохода
-            total_revenue = abc_summary['Доход (ГРН)'].sum()
-            abc_summary['Доля от общего дохода %'] = (abc_summary['Доход (ГРН)'] / total_revenue * 100).round(2)
-            
-            # Сортируем по категориям A, B, C
-            category_order = {'A': 0, 'B': 1, 'C': 2}
-            abc_summary['sort_key'] = abc_summary['Категория'].map(category_order)
-            abc_summary = abc_summary.sort_values('sort_key').drop('sort_key', axis=1)
-            
-            # Форматирование таблицы с эмодзи
-            abc_summary['Категория'] = abc_summary['Категория'].map({
-                'A': '⭐ Категория A (80% выручки)',
-                'B': '🔶 Категория B (15% выручки)',
-                'C': '🔻 Категория C (5% выручки)'
-            })
+            abc_summary = marketing['abc_summary']
             
             st.dataframe(
-                abc_summary.style.format({
+                style_table(abc_summary, {
                     'Кількість позиций': '{:.0f}',
                     'Доход (ГРН)': '{:.0f}',
                     'Доля от общего дохода %': '{:.2f}%'
-                }).background_gradient(subset=['Доход (ГРН)'], cmap='Greens'),
+                }, [
+                    dict(subset=['Доход (ГРН)'], cmap='Greens')
+                ]),
                 use_container_width=True,
                 hide_index=True
             )
@@ -2330,9 +3045,9 @@ def main():
             st.markdown("#### ⭐ Топ-10 товаров категории A (приносят наибольшую выручку)")
             
             top_a_products = product_analysis[product_analysis['Category'] == 'A'].head(10)
-            top_a_display = top_a_products[['Model', 'Qty', 'Sum']].copy()
-            top_a_display['Revenue_Share_%'] = (top_a_display['Sum'] / filtered_df['Sum'].sum() * 100).round(2)
-            top_a_display = top_a_display.rename(columns={
+            top_a_display = top_a_products[['Model', 'Qty', 'Sum']].assign(**{
+                'Revenue_Share_%': (top_a_products['Sum'] / revenue_total * 100).round(2)
+            }).rename(columns={
                 'Model': '🏷️ Модель',
                 'Qty': '📦 Продано',
                 'Sum': '💰 Выручка (ГРН)',
@@ -2340,11 +3055,13 @@ def main():
             })
             
             st.dataframe(
-                top_a_display.style.format({
+                style_table(top_a_display, {
                     '📦 Продано': '{:.0f}',
                     '💰 Выручка (ГРН)': '{:.0f}',
                     '📊 Доля выручки %': '{:.2f}%'
-                }).background_gradient(subset=['💰 Выручка (ГРН)'], cmap='Greens'),
+                }, [
+                    dict(subset=['💰 Выручка (ГРН)'], cmap='Greens')
+                ]),
                 use_container_width=True,
                 hide_index=True
             )
@@ -2352,281 +3069,17 @@ def main():
             # ТОП-20 товаров по категориям
             st.markdown("### 🏆 ТОП-20 товаров по категориям")
             
-            # Подготовка данных для анализа тренда
-            # Разделяем данные на 2 периода для сравнения
-            mid_date = filtered_df['Datasales'].min() + (filtered_df['Datasales'].max() - filtered_df['Datasales'].min()) / 2
-            
-            period1 = filtered_df[filtered_df['Datasales'] < mid_date]
-            period2 = filtered_df[filtered_df['Datasales'] >= mid_date]
-            
-            # Продажи по периодам
-            sales_period1 = period1.groupby('Model')['Qty'].sum()
-            sales_period2 = period2.groupby('Model')['Qty'].sum()
-            
-            # Общие продажіви
-            total_sales_by_model = filtered_df.groupby('Model').agg({
-                'Qty': 'sum',
-                'Sum': 'sum'
-            })
-            
-            # Расчет изменения
-            trend_data = pd.DataFrame({
-                'Model': total_sales_by_model.index,
-                'Total_Qty': total_sales_by_model['Qty'].values,
-                'Total_Revenue': total_sales_by_model['Sum'].values,
-                'Period1_Qty': sales_period1.reindex(total_sales_by_model.index, fill_value=0).values,
-                'Period2_Qty': sales_period2.reindex(total_sales_by_model.index, fill_value=0).values
-            })
-            
-            # Расчет процента изменения
-            trend_data["Change_%"] = np.where(
-                trend_data["Period1_Qty"] > 0,
-                ((trend_data["Period2_Qty"] - trend_data["Period1_Qty"]) / trend_data["Period1_Qty"]) * 100,
-                0
-            )
-            # Расчет процента изменения
-            trend_data["Change_%"] = np.where(
-                trend_data["Period1_Qty"] > 0,
-                ((trend_data["Period2_Qty"] - trend_data["Period1_Qty"]) / trend_data["Period1_Qty"]) * 100,
-                0
-            )
-            # Расчет процента изменения
-            trend_data["Change_%"] = np.where(
-                trend_data["Period1_Qty"] > 0,
-                ((trend_data["Period2_Qty"] - trend_data["Period1_Qty"]) / trend_data["Period1_Qty"]) * 100,
-                0
-            )
-            
-            # Стабильность (чем меньше изменение, тем стабильнее)
-            trend_data['Stability_Score'] = 100 - abs(trend_data['Change_%']).clip(upper=100)
-            
             # Создаем вкладки
             tab1, tab2, tab3 = st.tabs(["🏆 ТОП-20 Лучших", "📊 ТОП-20 Стабильных", "📉 ТОП-20 Падение"])
             
-            # ТОП-20 ЛУЧШИХ
             with tab1:
-                st.markdown("#### 🏆 ТОП-20 моделей по выручке")
-                
-                top_20_best = trend_data.nlargest(20, 'Total_Revenue').copy()
-                top_20_best['Avg_Price'] = top_20_best['Total_Revenue'] / top_20_best['Total_Qty']
-                
-                # График
-                fig_best = go.Figure()
-                
-                fig_best.add_trace(go.Bar(
-                    y=top_20_best['Model'],
-                    x=top_20_best['Total_Revenue'],
-                    orientation='h',
-                    marker=dict(
-                        color=top_20_best['Total_Revenue'],
-                        colorscale='Greens',
-                        showscale=True,
-                        colorbar=dict(title="Выручка<br>ГРН")
-                    ),
-                    text=top_20_best['Total_Revenue'].apply(lambda x: f'{x:.0f}'),
-                    textposition='outside',
-                    hovertemplate='<b>%{y}</b><br>Выручка: %{x:.0f} ГРН<br><extra></extra>'
-                ))
-                
-                fig_best.update_layout(
-                    title="ТОП-20 моделей по выручке",
-                    xaxis_title="Выручка (ГРН)",
-                    yaxis_title="Модель",
-                    height=600,
-                    yaxis={'categoryorder': 'total ascending'}
-                )
-                
-                st.plotly_chart(fig_best, use_container_width=True, key="top20_best")
-                
-                # Таблица
-                st.markdown("##### 📋 Детальная информация")
-                
-                display_best = top_20_best[['Model', 'Total_Qty', 'Total_Revenue', 'Avg_Price', 'Change_%']].copy()
-                display_best = display_best.reset_index(drop=True)
-                display_best.index = display_best.index + 1
-                display_best = display_best.rename(columns={
-                    'Model': '🏷️ Модель',
-                    'Total_Qty': '📦 Продано',
-                    'Total_Revenue': '💰 Выручка (ГРН)',
-                    'Avg_Price': '💵 Средняя цена',
-                    'Change_%': '📈 Изменение %'
-                })
-                
-                st.dataframe(
-                    display_best.style.format({
-                        '📦 Продано': '{:.0f}',
-                        '💰 Выручка (ГРН)': '{:.0f}',
-                        '💵 Средняя цена': '{:.2f}',
-                        '📈 Изменение %': '{:+.1f}%'
-                    }).background_gradient(subset=['💰 Выручка (ГРН)'], cmap='Greens')
-                    .background_gradient(subset=['📈 Изменение %'], cmap='RdYlGn', vmin=-50, vmax=50),
-                    use_container_width=True
-                )
-                
-                # Инсайты
-                st.success(f"💎 **Лидер продажів**: {top_20_best.iloc[0]['Model']} - выручка {top_20_best.iloc[0]['Total_Revenue']:.0f} ГРН")
-                
-                growth_products = top_20_best[top_20_best['Change_%'] > 20]
-                if len(growth_products) > 0:
-                    st.info(f"🚀 **Растущие хиты**: {len(growth_products)} товаров показывают рост более 20%")
+                show_top_best(trend_data, revenue_rank)
             
-            # ТОП-20 СТАБИЛЬНЫХ
             with tab2:
-                st.markdown("#### 📊 ТОП-20 самых стабильных моделей")
-                st.caption("Товары с минимальными колебаниями продажів между периодами")
-                
-                # Фильтруем только те товары, которые продавались в обоих периодах
-                stable_products = trend_data[(trend_data['Period1_Qty'] > 0) & (trend_data['Period2_Qty'] > 0)].copy()
-                top_20_stable = stable_products.nlargest(20, 'Stability_Score')
-                top_20_stable['Avg_Price'] = top_20_stable['Total_Revenue'] / top_20_stable['Total_Qty']
-                
-                # График
-                fig_stable = go.Figure()
-                
-                fig_stable.add_trace(go.Bar(
-                    y=top_20_stable['Model'],
-                    x=top_20_stable['Stability_Score'],
-                    orientation='h',
-                    marker=dict(
-                        color=top_20_stable['Stability_Score'],
-                        colorscale='Blues',
-                        showscale=True,
-                        colorbar=dict(title="Стабильность<br>%")
-                    ),
-                    text=top_20_stable['Stability_Score'].apply(lambda x: f'{x:.1f}'),
-                    textposition='outside',
-                    hovertemplate='<b>%{y}</b><br>Стабильность: %{x:.1f}%<br><extra></extra>'
-                ))
-                
-                fig_stable.update_layout(
-                    title="ТОП-20 самых стабильных моделей",
-                    xaxis_title="Индекс стабильности (%)",
-                    yaxis_title="Модель",
-                    height=600,
-                    yaxis={'categoryorder': 'total ascending'}
-                )
-                
-                st.plotly_chart(fig_stable, use_container_width=True, key="top20_stable")
-                
-                # Таблица
-                st.markdown("##### 📋 Детальная информация")
-                
-                display_stable = top_20_stable[['Model', 'Total_Qty', 'Total_Revenue', 'Avg_Price', 'Change_%', 'Stability_Score']].copy()
-                display_stable = display_stable.reset_index(drop=True)
-                display_stable.index = display_stable.index + 1
-                display_stable = display_stable.rename(columns={
-                    'Model': '🏷️ Модель',
-                    'Total_Qty': '📦 Продано',
-                    'Total_Revenue': '💰 Выручка (ГРН)',
-                    'Avg_Price': '💵 Средняя цена',
-                    'Change_%': '📈 Изменение %',
-                    'Stability_Score': '📊 Стабильность %'
-                })
-                
-                st.dataframe(
-                    display_stable.style.format({
-                        '📦 Продано': '{:.0f}',
-                        '💰 Выручка (ГРН)': '{:.0f}',
-                        '💵 Средняя цена': '{:.2f}',
-                        '📈 Изменение %': '{:+.1f}%',
-                        '📊 Стабильность %': '{:.1f}%'
-                    }).background_gradient(subset=['📊 Стабильность %'], cmap='Blues'),
-                    use_container_width=True
-                )
-                
-                # Инсайты
-                st.success(f"🎯 **Самый стабильный**: {top_20_stable.iloc[0]['Model']} - стабильность {top_20_stable.iloc[0]['Stability_Score']:.1f}%")
-                st.info(f"💡 **Рекомендація**: Стабильные товары идеальны для постоянного наличия на складе")
+                show_top_stable(trend_data)
             
-            # ТОП-20 ПАДЕНИЕ
             with tab3:
-                st.markdown("#### 📉 ТОП-20 моделей с наибольшим падением")
-                st.caption("Товары, показывающие снижение продажів")
-                
-                # Только товары с падением
-                declining_products = trend_data[trend_data['Change_%'] < 0].copy()
-                
-                if len(declining_products) > 0:
-                    top_20_declining = declining_products.nsmallest(20, 'Change_%')
-                    top_20_declining['Avg_Price'] = top_20_declining['Total_Revenue'] / top_20_declining['Total_Qty']
-                    
-                    # График
-                    fig_decline = go.Figure()
-                    
-                    fig_decline.add_trace(go.Bar(
-                        y=top_20_declining['Model'],
-                        x=top_20_declining['Change_%'],
-                        orientation='h',
-                        marker=dict(
-                            color=top_20_declining['Change_%'],
-                            colorscale='Reds_r',
-                            showscale=True,
-                            colorbar=dict(title="Падение<br>%")
-                        ),
-                        text=top_20_declining['Change_%'].apply(lambda x: f'{x:.1f}%'),
-                        textposition='outside',
-                        hovertemplate='<b>%{y}</b><br>Падение: %{x:.1f}%<br><extra></extra>'
-                    ))
-                    
-                    fig_decline.update_layout(
-                        title="ТОП-20 моделей с наибольшим падением продажів",
-                        xaxis_title="Изменение (%)",
-                        yaxis_title="Модель",
-                        height=600,
-                        yaxis={'categoryorder': 'total descending'}
-                    )
-                    
-                    st.plotly_chart(fig_decline, use_container_width=True, key="top20_decline")
-                    
-                    # Таблица
-                    st.markdown("##### 📋 Детальная информация")
-                    
-                    display_decline = top_20_declining[['Model', 'Total_Qty', 'Total_Revenue', 'Period1_Qty', 'Period2_Qty', 'Change_%']].copy()
-                    display_decline = display_decline.reset_index(drop=True)
-                    display_decline.index = display_decline.index + 1
-                    display_decline = display_decline.rename(columns={
-                        'Model': '🏷️ Модель',
-                        'Total_Qty': '📦 Всего продано',
-                        'Total_Revenue': '💰 Выручка (ГРН)',
-                        'Period1_Qty': '📊 1-й период',
-                        'Period2_Qty': '📊 2-й период',
-                        'Change_%': '📉 Падение %'
-                    })
-                    
-                    st.dataframe(
-                        display_decline.style.format({
-                            '📦 Всего продано': '{:.0f}',
-                            '💰 Выручка (ГРН)': '{:.0f}',
-                            '📊 1-й период': '{:.0f}',
-                            '📊 2-й период': '{:.0f}',
-                            '📉 Падение %': '{:.1f}%'
-                        }).background_gradient(subset=['📉 Падение %'], cmap='Reds_r'),
-                        use_container_width=True
-                    )
-                    
-                    # Алерты и рекомендации
-                    critical_decline = top_20_declining[top_20_declining['Change_%'] < -50]
-                    
-                    if len(critical_decline) > 0:
-                        st.error(f"🚨 **КРИТИЧНО**: {len(critical_decline)} товаров с падением более 50%!")
-                    
-                    st.warning(f"⚠️ **Проблемный товар**: {top_20_declining.iloc[0]['Model']} - падение {top_20_declining.iloc[0]['Change_%']:.1f}%")
-                    
-                    st.markdown("##### 💡 Рекомендации по проблемным товарам:")
-                    recommendations = [
-                        "🎯 Провести анализ причин падения (конкуренция, цена, актуальность)",
-                        "🔥 Запустить промо-акции со скидками 20-30%",
-                        "📢 Усилить маркетинг и рекламу",
-                        "💡 Рассмотреть обновление ассортимента или замену товара",
-                        "📦 Снизить закупки до стабилизации ситуации"
-                    ]
-                    
-                    for rec in recommendations:
-                        st.markdown(f'<div class="insight-card">{rec}</div>', unsafe_allow_html=True)
-                    
-                else:
-                    st.success("✅ Отличные новости! Нет товаров с падением продажів")
-                    st.balloons()
+                show_top_declining(trend_data, celebrate=first_build)
             
             # Маркетинговые рекомендации
             st.markdown("### 🎯 Маркетинговые рекомендации")
@@ -2635,55 +3088,45 @@ def main():
             st.markdown("#### 📊 Ключевые метрики маркетинга")
             
             # Расчет метрик
-            top_5_revenue = trend_data.nlargest(5, 'Total_Revenue')
-            total_revenue_all = trend_data['Total_Revenue'].sum()
-            top_5_share = (top_5_revenue['Total_Revenue'].sum() / total_revenue_all) * 100
-            top_10_share = (trend_data.nlargest(10, 'Total_Revenue')['Total_Revenue'].sum() / total_revenue_all) * 100
-            
-            declining_count = len(trend_data[trend_data['Change_%'] < -20])
-            growing_count = len(trend_data[trend_data['Change_%'] > 20])
-            stable_count = len(trend_data[(trend_data['Change_%'] >= -20) & (trend_data['Change_%'] <= 20)])
-            
-            avg_transaction = filtered_df['Sum'].sum() / len(filtered_df) if len(filtered_df) > 0 else 0
-            avg_price = filtered_df['Price'].mean()
-            avg_qty_per_transaction = filtered_df.groupby('Datasales')['Qty'].sum().mean()
-            
-            # Создание таблицы метрик
-            metrics_data = {
-                'Метрика': [
-                    'Доля ТОП-5 товаров',
-                    'Доля ТОП-10 товаров',
-                    'Товаров с ростом >20%',
-                    'Товаров с падением >20%',
-                    'Стабильных товаров',
-                    'Средний чек',
-                    'Средняя цена товара',
-                    'Середні продажіві/день'
-                ],
-                'Значение': [
-                    f'{top_5_share:.1f}%',
-                    f'{top_10_share:.1f}%',
-                    f'{growing_count} шт.',
-                    f'{declining_count} шт.',
-                    f'{stable_count} шт.',
-                    f'{avg_transaction:.0f} ГРН',
-                    f'{avg_price:.0f} ГРН',
-                    f'{avg_qty_per_transaction:.1f} шт.'
-                ],
-                'Статус': [
-                    '⚠️ Риск' if top_5_share > 50 else '✅ Норма',
-                    '⚠️ Риск' if top_10_share > 70 else '✅ Норма',
-                    '✅ Рост' if growing_count > 10 else '⚠️ Мало',
-                    '🚨 Критично' if declining_count > 10 else ('⚠️ Внимание' if declining_count > 0 else '✅ OK'),
-                    '✅ Хорошо' if stable_count > 20 else '⚠️ Мало',
-                    '⚠️ Низкий' if avg_transaction < filtered_df['Sum'].mean() * 0.8 else '✅ Норма',
-                    '✅ Норма',
-                    '✅ Норма'
-                ]
-            }
+            trend_summary = marketing['trend_summary']
+            total_revenue_all = trend_summary['total_revenue_all']
+            top_5_share = trend_summary['top_5_share']
+            top_10_share = trend_summary['top_10_share']
+            
+            declining_count = trend_summary['declining_count']
+            growing_count = trend_summary['growing_count']
+            stable_count = trend_summary['stable_count']
+            
+            avg_price = filtered_df['Price'].to_numpy().mean()
+            avg_qty_per_transaction = avg_daily_sales
+            
+            # Порог низкого чека (80% средней суммы строки) считается один раз для таблицы, выводов и инсайтов
+            low_check_threshold = filtered_df['Sum'].mean() * 0.8
+            low_avg_check = avg_transaction < low_check_threshold
+            
+            # Таблица метрик: строки (метрика, значение, статус) уже отформатированы,
+            # поэтому выводится одной Markdown-таблицей без DataFrame и Arrow-сериализации
+            metrics_rows = [
+                ('Доля ТОП-5 товаров', f'{top_5_share:.1f}%',
+                 '⚠️ Риск' if top_5_share > 50 else '✅ Норма'),
+                ('Доля ТОП-10 товаров', f'{top_10_share:.1f}%',
+                 '⚠️ Риск' if top_10_share > 70 else '✅ Норма'),
+                ('Товаров с ростом >20%', f'{growing_count} шт.',
+                 '✅ Рост' if growing_count > 10 else '⚠️ Мало'),
+                ('Товаров с падением >20%', f'{declining_count} шт.',
+                 '🚨 Критично' if declining_count > 10 else ('⚠️ Внимание' if declining_count > 0 else '✅ OK')),
+                ('Стабильных товаров', f'{stable_count} шт.',
+                 '✅ Хорошо' if stable_count > 20 else '⚠️ Мало'),
+                ('Средний чек', f'{avg_transaction:.0f} ГРН',
+                 '⚠️ Низкий' if low_avg_check else '✅ Норма'),
+                ('Средняя цена товара', f'{avg_price:.0f} ГРН', '✅ Норма'),
+                ('Середні продажіві/день', f'{avg_qty_per_transaction:.1f} шт.', '✅ Норма')
+            ]
             
-            metrics_df = pd.DataFrame(metrics_data)
-            st.dataframe(metrics_df, use_container_width=True, hide_index=True)
+            st.markdown(
+                '| Метрика | Значение | Статус |\n|---|---|---|\n'
+                + '\n'.join(f'| {label} | {value} | {status} |' for label, value, status in metrics_rows)
+            )
             
             # Выводы и ивенты
             st.markdown("#### 💡 Ключевые выводы")
@@ -2709,18 +3152,17 @@ def main():
                 events.append(f"✅ СОБЫТИЕ: {growing_count} товаров демонстрируют рост (>20%)")
             
             # Анализ среднего чека
-            if avg_transaction < filtered_df['Sum'].mean() * 0.8:
+            if low_avg_check:
                 conclusions.append("💳 **Низкий средний чек** - потенциал увеличения через cross-sell")
                 events.append(f"💰 СОБЫТИЕ: Средний чек {avg_transaction:.0f} ГРН ниже оптимального")
             
             # Дополнительные события
             if total_revenue_all > 0:
-                top_product = trend_data.nlargest(1, 'Total_Revenue').iloc[0]
+                top_product = trend_data.iloc[revenue_rank[0]]
                 events.append(f"🏆 ЛИДЕР: {top_product['Model']} - {top_product['Total_Revenue']:.0f} ГРН выручки")
             
             # Отображение выводов
-            for conclusion in conclusions:
-                st.markdown(f'<div class="insight-card">{conclusion}</div>', unsafe_allow_html=True)
+            render_cards(conclusions)
             
             st.markdown("#### 📅 Важные события периода")
             for event in events:
@@ -2755,7 +3197,7 @@ def main():
                     'text': f"{declining_count} товаров с падением >20%. Проведите анализ и акции."
                 })
             
-            if avg_transaction < filtered_df['Sum'].mean() * 0.8:
+            if low_avg_check:
                 marketing_insights.append({
                     'type': 'info',
                     'title': '💳 Низкий средний чек',
@@ -2776,8 +3218,7 @@ def main():
             # Конкретные действия
             st.markdown("#### 📋 План действий на ближайшие 30 дней")
             
-            top_20_best_count = len(trend_data.nlargest(20, 'Total_Revenue'))
-            declining_count_action = len(trend_data[trend_data['Change_%'] < -20])
+            top_20_best_count = len(revenue_rank)
             
             action_plan = [
                 f"1️⃣ **ТОП товары**: Увеличить бюджет на рекламу ТОП-{top_20_best_count} товаров на 30%",
@@ -2787,216 +3228,148 @@ def main():
                 f"5️⃣ **Мониторинг**: Еженедельно отслеживать динамику падающих товаров"
             ]
             
-            for action in action_plan:
-                st.markdown(f'<div class="insight-card">{action}</div>', unsafe_allow_html=True)
+            render_cards(action_plan)
             
-            # Анализ эластичности спроса
+            # Анализ эластичности спроса: расчет, график и таблицы выполняются только при включенном переключателе
             st.markdown("### 📐 Анализ эластичности спроса")
             st.markdown("Оценка чувствительности спроса к изменению цены (анализ по всему датасету)")
             
-            # Расчет эластичности для товаров с достаточными данными
-            elasticity_data = []
-            
-            # Используем весь датасет df вместо filtered_df
-            all_models = df['Model'].unique()
-            
-            # Анализируем все модели с достаточным количеством данных
-            for model in all_models:
-                model_data = df[df['Model'] == model].copy()
-                
-                if len(model_data) >= 10:  # Минимум 10 записей для анализа
-                    # Группировка по ценовым диапазонам
-                    try:
-                        model_data['Price_Group'] = pd.qcut(model_data['Price'], q=3, labels=['Низкая', 'Средняя', 'Высокая'], duplicates='drop')
-                    except:
-                        # Если не получается разбить на 3 группы, пробуем на 2
-                        try:
-                            model_data['Price_Group'] = pd.qcut(model_data['Price'], q=2, labels=['Низкая', 'Высокая'], duplicates='drop')
-                        except:
-                            continue
-                    
-                    price_analysis = model_data.groupby('Price_Group').agg({
-                        'Price': 'mean',
-                        'Qty': 'sum'
-                    }).reset_index()
-                    
-                    if len(price_analysis) >= 2:
-                        # Простой расчет эластичности между крайними группами
-                        if price_analysis.iloc[0]['Price'] != price_analysis.iloc[-1]['Price']:
-                            price_change_pct = ((price_analysis.iloc[-1]['Price'] - price_analysis.iloc[0]['Price']) / 
-                                              price_analysis.iloc[0]['Price']) * 100
-                            qty_change_pct = ((price_analysis.iloc[-1]['Qty'] - price_analysis.iloc[0]['Qty']) / 
-                                            price_analysis.iloc[0]['Qty']) * 100
-                            
-                            if price_change_pct != 0:
-                                elasticity = qty_change_pct / price_change_pct
-                                
-                                # Классификация эластичности
-                                if abs(elasticity) > 1:
-                                    elasticity_type = "Эластичный"
-                                    recommendation = "Снижение цены увеличит выручку"
-                                elif abs(elasticity) < 1:
-                                    elasticity_type = "Неэластичный"
-                                    recommendation = "Повышение цены увеличит выручку"
-                                else:
-                                    elasticity_type = "Единичный"
-                                    recommendation = "Цена оптимальна"
-                                
-                                total_revenue = model_data['Sum'].sum()
-                                avg_price = model_data['Price'].mean()
-                                total_qty = model_data['Qty'].sum()
-                                
-                                elasticity_data.append({
-                                    'Model': model,
-                                    'Elasticity': elasticity,
-                                    'Type': elasticity_type,
-                                    'Avg_Price': avg_price,
-                                    'Total_Revenue': total_revenue,
-                                    'Total_Qty': total_qty,
-                                    'Price_Change_%': price_change_pct,
-                                    'Qty_Change_%': qty_change_pct,
-                                    'Recommendation': recommendation
-                                })
-            
-            if len(elasticity_data) > 0:
-                elasticity_df = pd.DataFrame(elasticity_data)
-                elasticity_df = elasticity_df.sort_values('Total_Revenue', ascending=False)
-                
-                # Метрики эластичности
-                col1, col2, col3, col4 = st.columns(4)
-                
-                elastic_count = len(elasticity_df[elasticity_df['Type'] == 'Эластичный'])
-                inelastic_count = len(elasticity_df[elasticity_df['Type'] == 'Неэластичный'])
-                unit_count = len(elasticity_df[elasticity_df['Type'] == 'Единичный'])
-                
-                with col1:
-                    st.metric("📊 Проанализировано товаров", len(elasticity_df))
-                with col2:
-                    st.metric("⚡ Эластичных", elastic_count)
-                with col3:
-                    st.metric("🔒 Неэластичных", inelastic_count)
-                with col4:
-                    st.metric("⚖️ Единичных", unit_count)
-                
-                # График эластичности
-                st.markdown("#### 📈 Распределение коэффициентов эластичности")
-                
-                fig_elasticity = go.Figure()
-                
-                colors = elasticity_df['Type'].map({
-                    'Эластичный': '#ff6b6b',
-                    'Неэластичный': '#51cf66',
-                    'Единичный': '#ffd43b'
-                })
-                
-                fig_elasticity.add_trace(go.Bar(
-                    y=elasticity_df['Model'].head(20),
-                    x=elasticity_df['Elasticity'].head(20),
-                    orientation='h',
-                    marker=dict(
-                        color=colors.head(20),
-                        line=dict(color='white', width=1)
-                    ),
-                    text=elasticity_df['Elasticity'].head(20).apply(lambda x: f'{x:.2f}'),
-                    textposition='outside',
-                    hovertemplate='<b>%{y}</b><br>Эластичность: %{x:.2f}<extra></extra>'
-                ))
-                
-                fig_elasticity.add_vline(x=-1, line_dash="dash", line_color="red", 
-                                        annotation_text="Граница эластичности")
-                fig_elasticity.add_vline(x=1, line_dash="dash", line_color="red")
-                
-                fig_elasticity.update_layout(
-                    title="ТОП-20 товаров по коэффициенту эластичности (весь датасет)",
-                    xaxis_title="Коэффициент эластичности",
-                    yaxis_title="Модель",
-                    height=600,
-                    showlegend=False
-                )
-                
-                st.plotly_chart(fig_elasticity, use_container_width=True)
-                
-                # Таблица с рекомендациями
-                st.markdown("#### 📋 Детальный анализ и рекомендации")
-                
-                display_elasticity = elasticity_df.head(20)[['Model', 'Type', 'Elasticity', 
-                                                             'Avg_Price', 'Total_Revenue', 'Total_Qty',
-                                                             'Price_Change_%', 'Qty_Change_%', 
-                                                             'Recommendation']].copy()
-                
-                display_elasticity = display_elasticity.rename(columns={
-                    'Model': '🏷️ Модель',
-                    'Type': '📊 Тип',
-                    'Elasticity': '📐 Эластичность',
-                    'Avg_Price': '💰 Средняя цена',
-                    'Total_Revenue': '💵 Выручка',
-                    'Total_Qty': '📦 Продано шт.',
-                    'Price_Change_%': '📈 Изм. цены %',
-                    'Qty_Change_%': '📊 Изм. объема %',
-                    'Recommendation': '💡 Рекомендація'
-                })
-                
-                st.dataframe(
-                    display_elasticity.style.format({
-                        '📐 Эластичность': '{:.2f}',
-                        '💰 Средняя цена': '{:.0f} ГРН',
-                        '💵 Выручка': '{:.0f} ГРН',
-                        '📦 Продано шт.': '{:.0f}',
-                        '📈 Изм. цены %': '{:.1f}%',
-                        '📊 Изм. объема %': '{:.1f}%'
-                    }).applymap(
-                        lambda x: 'background-color: #ffebee' if x == 'Эластичный' else 
-                                 ('background-color: #e8f5e9' if x == 'Неэластичный' else 
-                                  ('background-color: #fff9c4' if x == 'Единичный' else '')),
-                        subset=['📊 Тип']
-                    ),
-                    use_container_width=True
-                )
-                
-                # Стратегические рекомендации
-                st.markdown("#### 🎯 Стратегические рекомендации по ценообразованию")
+            if st.toggle("Показать анализ эластичности", key='show_elasticity'):
+                # Расчет эластичности для товаров с достаточными данными (используем весь датасет df)
+                elasticity_df = compute_price_elasticity(data_key, df)
+            
+                if len(elasticity_df) > 0:
+                    # Для графика и таблицы нужны только 20 лидеров по выручке - argpartition без полной сортировки
+                    top_elasticity = elasticity_df.iloc[top_n_positions(elasticity_df['Total_Revenue'].to_numpy(), 20)]
+                
+                    # Метрики эластичности
+                    col1, col2, col3, col4 = st.columns(4)
+                
+                    elastic_count = len(elasticity_df[elasticity_df['Type'] == 'Эластичный'])
+                    inelastic_count = len(elasticity_df[elasticity_df['Type'] == 'Неэластичный'])
+                    unit_count = len(elasticity_df[elasticity_df['Type'] == 'Единичный'])
+                
+                    with col1:
+                        st.metric("📊 Проанализировано товаров", len(elasticity_df))
+                    with col2:
+                        st.metric("⚡ Эластичных", elastic_count)
+                    with col3:
+                        st.metric("🔒 Неэластичных", inelastic_count)
+                    with col4:
+                        st.metric("⚖️ Единичных", unit_count)
+                
+                    # График эластичности
+                    st.markdown("#### 📈 Распределение коэффициентов эластичности")
+                
+                    # Трасса и layout (включая линии границ ±1) передаются сразу в конструктор
+                    elasticity_values = top_elasticity['Elasticity'].to_numpy()
+                    boundary = dict(type='line', y0=0, y1=1, yref='paper', line=dict(color='red', dash='dash'))
+                    fig_elasticity = go.Figure(
+                        data=[go.Bar(
+                            y=top_elasticity['Model'].to_numpy(),
+                            x=elasticity_values,
+                            orientation='h',
+                            marker=dict(
+                                color=ELASTICITY_COLORS[top_elasticity['Type'].cat.codes.to_numpy()],
+                                line=dict(color='white', width=1)
+                            ),
+                            text=[f'{x:.2f}' for x in elasticity_values],
+                            textposition='outside',
+                            hovertemplate='<b>%{y}</b><br>Эластичность: %{x:.2f}<extra></extra>'
+                        )],
+                        layout=dict(
+                            title="ТОП-20 товаров по коэффициенту эластичности (весь датасет)",
+                            xaxis_title="Коэффициент эластичности",
+                            yaxis_title="Модель",
+                            height=600,
+                            showlegend=False,
+                            shapes=[dict(boundary, x0=-1, x1=-1), dict(boundary, x0=1, x1=1)],
+                            annotations=[dict(x=-1, y=1, yref='paper', text="Граница эластичности",
+                                              showarrow=False, xanchor='left', yanchor='top')]
+                        )
+                    )
+
+                    st.plotly_chart(fig_elasticity)
                 
-                elastic_revenue = elasticity_df[elasticity_df['Type'] == 'Эластичный']['Total_Revenue'].sum()
-                inelastic_revenue = elasticity_df[elasticity_df['Type'] == 'Неэластичный']['Total_Revenue'].sum()
-                total_analyzed_revenue = elastic_revenue + inelastic_revenue
+                    # Таблица с рекомендациями
+                    st.markdown("#### 📋 Детальный анализ и рекомендации")
                 
-                pricing_recommendations = []
+                    display_elasticity = top_elasticity[['Model', 'Type', 'Elasticity', 
+                                                                 'Avg_Price', 'Total_Revenue', 'Total_Qty',
+                                                                 'Price_Change_%', 'Qty_Change_%', 
+                                                                 'Recommendation']]
                 
-                if elastic_count > 0:
-                    elastic_share = (elastic_revenue / total_analyzed_revenue * 100) if total_analyzed_revenue > 0 else 0
-                    pricing_recommendations.append(
-                        f"🔴 **Эластичные товары ({elastic_count} шт., {elastic_share:.1f}% выручки)**: "
-                        f"Снижение цены на 10-15% может увеличить объем продажів на >10%. "
-                        f"Используйте акции и промо для роста выручки."
-                    )
+                    display_elasticity = display_elasticity.rename(columns={
+                        'Model': '🏷️ Модель',
+                        'Type': '📊 Тип',
+                        'Elasticity': '📐 Эластичность',
+                        'Avg_Price': '💰 Средняя цена',
+                        'Total_Revenue': '💵 Выручка',
+                        'Total_Qty': '📦 Продано шт.',
+                        'Price_Change_%': '📈 Изм. цены %',
+                        'Qty_Change_%': '📊 Изм. объема %',
+                        'Recommendation': '💡 Рекомендація'
+                    })
                 
-                if inelastic_count > 0:
-                    inelastic_share = (inelastic_revenue / total_analyzed_revenue * 100) if total_analyzed_revenue > 0 else 0
-                    pricing_recommendations.append(
-                        f"🟢 **Неэластичные товары ({inelastic_count} шт., {inelastic_share:.1f}% выручки)**: "
-                        f"Повышение цены на 5-10% не повлияет критично на спрос. "
-                        f"Можно увеличить маржинальность."
+                    st.dataframe(
+                        display_elasticity.style.format({
+                            '📐 Эластичность': '{:.2f}',
+                            '💰 Средняя цена': '{:.0f} ГРН',
+                            '💵 Выручка': '{:.0f} ГРН',
+                            '📦 Продано шт.': '{:.0f}',
+                            '📈 Изм. цены %': '{:.1f}%',
+                            '📊 Изм. объема %': '{:.1f}%'
+                        }).apply(
+                            # Фон типа берется по кодам категории для всей колонки сразу, без лямбды на ячейку
+                            lambda col: ELASTICITY_BG_STYLES[col.cat.codes.to_numpy()],
+                            subset=['📊 Тип']
+                        ),
+                        use_container_width=True
                     )
                 
-                if unit_count > 0:
-                    pricing_recommendations.append(
-                        f"🟡 **Единично-эластичные товары ({unit_count} шт.)**: "
-                        f"Цена близка к оптимальной. Сфокусируйтесь на удержании позиций."
+                    # Стратегические рекомендации
+                    st.markdown("#### 🎯 Стратегические рекомендации по ценообразованию")
+                
+                    elastic_revenue = elasticity_df[elasticity_df['Type'] == 'Эластичный']['Total_Revenue'].sum()
+                    inelastic_revenue = elasticity_df[elasticity_df['Type'] == 'Неэластичный']['Total_Revenue'].sum()
+                    total_analyzed_revenue = elastic_revenue + inelastic_revenue
+                
+                    pricing_recommendations = []
+                
+                    if elastic_count > 0:
+                        elastic_share = (elastic_revenue / total_analyzed_revenue * 100) if total_analyzed_revenue > 0 else 0
+                        pricing_recommendations.append(
+                            f"🔴 **Эластичные товары ({elastic_count} шт., {elastic_share:.1f}% выручки)**: "
+                            f"Снижение цены на 10-15% может увеличить объем продажів на >10%. "
+                            f"Используйте акции и промо для роста выручки."
+                        )
+                
+                    if inelastic_count > 0:
+                        inelastic_share = (inelastic_revenue / total_analyzed_revenue * 100) if total_analyzed_revenue > 0 else 0
+                        pricing_recommendations.append(
+                            f"🟢 **Неэластичные товары ({inelastic_count} шт., {inelastic_share:.1f}% выручки)**: "
+                            f"Повышение цены на 5-10% не повлияет критично на спрос. "
+                            f"Можно увеличить маржинальность."
+                        )
+                
+                    if unit_count > 0:
+                        pricing_recommendations.append(
+                            f"🟡 **Единично-эластичные товары ({unit_count} шт.)**: "
+                            f"Цена близка к оптимальной. Сфокусируйтесь на удержании позиций."
+                        )
+                
+                    render_cards(pricing_recommendations)
+                
+                    # Общие выводы по эластичности
+                    st.info(
+                        f"💡 **Ключевой вывод**: Из {len(elasticity_df)} проанализированных товаров "
+                        f"{elastic_count} являются эластичными (чувствительны к цене), "
+                        f"{inelastic_count} - неэластичными (нечувствительны к цене). "
+                        f"Используйте эти данные для оптимизации ценовой стратегии."
                     )
                 
-                for rec in pricing_recommendations:
-                    st.markdown(f'<div class="insight-card">{rec}</div>', unsafe_allow_html=True)
-                
-                # Общие выводы по эластичности
-                st.info(
-                    f"💡 **Ключевой вывод**: Из {len(elasticity_df)} проанализированных товаров "
-                    f"{elastic_count} являются эластичными (чувствительны к цене), "
-                    f"{inelastic_count} - неэластичными (нечувствительны к цене). "
-                    f"Используйте эти данные для оптимизации ценовой стратегии."
-                )
-                
-            else:
-                st.warning("⚠️ Недостатньо даних для анализа эластичности спроса. Требуется больше исторических данных с вариацией цен.")
+                else:
+                    st.warning("⚠️ Недостатньо даних для анализа эластичности спроса. Требуется больше исторических данных с вариацией цен.")
 
             st.markdown("---")
             st.markdown("## 🎓 Рекомендації ML інженера та Data Scientist")
@@ -3005,25 +3378,16 @@ def main():
             st.markdown("### 📊 Якість прогнозної моделі")
 
             model_quality_score = confidence_score
-            if model_quality_score >= 80:
-                quality_color = "green"
-                quality_status = "Відмінна"
-                quality_emoji = "✅"
-            elif model_quality_score >= 60:
-                quality_color = "orange"
-                quality_status = "Добра"
-                quality_emoji = "⚠️"
-            else:
-                quality_color = "red"
-                quality_status = "Потребує покращення"
-                quality_emoji = "❌"
+            quality_color, quality_status, quality_emoji = QUALITY_STATUS[
+                np.searchsorted(QUALITY_BANDS, model_quality_score, side='right')
+            ]
 
             st.markdown(
-                f'<div class="insight-card">'
-                f'{quality_emoji} <strong>Загальна оцінка моделі: {quality_status}</strong> '
-                f'(Точність: {model_quality_score:.1f}%)<br>'
-                f'<small>Модель базується на алгоритмі Prophet от Meta, що враховує тренди та сезонність</small>'
-                f'</div>',
+                INSIGHT_CARD_TPL.format(body=(
+                    f'{quality_emoji} <strong>Загальна оцінка моделі: {quality_status}</strong> '
+                    f'(Точність: {model_quality_score:.1f}%)<br>'
+                    f'<small>Модель базується на алгоритмі Prophet от Meta, що враховує тренди та сезонність</small>'
+                )),
                 unsafe_allow_html=True
             )
 
@@ -3033,7 +3397,6 @@ def main():
             tech_recommendations = []
 
             # Рекомендація по объему данных
-            data_days = (filtered_df['Datasales'].max() - filtered_df['Datasales'].min()).days
             if data_days < 90:
                 tech_recommendations.append(
                     "📅 **Розширте історичні дані**: Для більш точних прогнозів рекомендується мати "
@@ -3047,7 +3410,7 @@ def main():
             )
 
             # Рекомендація по сезонности
-            if len(filtered_df) > 365:
+            if n_rows > 365:
                 tech_recommendations.append(
                     "📈 **Сезонні патерни**: Виявлено річні дані. Модель автоматично враховує "
                     "сезонні коливання. Плануйте запаси з урахуванням виявлених патернів."
@@ -3060,8 +3423,7 @@ def main():
                     "прогноза, але може пропустити реальні сплески попиту. Аналізуйте викиди окремо."
                 )
 
-            for rec in tech_recommendations:
-                st.markdown(f'<div class="insight-card">{rec}</div>', unsafe_allow_html=True)
+            render_cards(tech_recommendations)
 
             # Бізнес-рекомендації
             st.markdown("### 💼 Бізнес-рекомендації")
@@ -3069,19 +3431,8 @@ def main():
             business_recommendations = []
 
             # Анализ тренда
-            forecast_trend = detailed_forecast['🎯 Реальний'].iloc[-7:].mean() - detailed_forecast['🎯 Реальний'].iloc[:7].mean()
-            if forecast_trend > 0:
-                trend_direction = "зростає"
-                trend_action = "Збільшіть запаси та підготуйтеся до зростання попиту"
-                trend_emoji = "📈"
-            elif forecast_trend < 0:
-                trend_direction = "знижується"
-                trend_action = "Оптимізуйте складські залишки, розгляньте промо-акції"
-                trend_emoji = "📉"
-            else:
-                trend_direction = "стабільний"
-                trend_action = "Підтримуйте поточний рівень запасів"
-                trend_emoji = "➡️"
+            forecast_trend = scen_int[-7:, 1].mean() - scen_int[:7, 1].mean()
+            trend_direction, trend_action, trend_emoji = TREND_OUTCOMES[int(np.sign(forecast_trend)) + 1]
 
             business_recommendations.append(
                 f"{trend_emoji} **Тренд попиту**: Прогноз показує, що попит {trend_direction}. "
@@ -3090,35 +3441,23 @@ def main():
 
             # Рекомендація по планированию
             planning_horizon = forecast_days
-            if planning_horizon <= 14:
-                planning_rec = "Короткострокове планування: фокус на оперативному управлінні запасами"
-            elif planning_horizon <= 30:
-                planning_rec = "Середньострокове планування: оптимізуйте замовлення у постачальників"
-            else:
-                planning_rec = "Довгострокове планування: використовуйте для стратегічних рішень та бюджетування"
+            planning_rec = PLANNING_RECS[np.searchsorted(PLANNING_BANDS, planning_horizon, side='left')]
 
             business_recommendations.append(
                 f"📅 **Горизонт планування ({planning_horizon} дн.)**: {planning_rec}"
             )
 
             # Рекомендація по точности
-            if accuracy_metrics:
-                mape = accuracy_metrics.get('MAPE', 0)
-                if mape < 10:
-                    accuracy_rec = "Дуже висока точність - можете впевнено планувати закупівлі"
-                elif mape < 20:
-                    accuracy_rec = "Добра точність - рекомендується буфер запасу 10-15%"
-                else:
-                    accuracy_rec = "Середня точність - тримайте страховий запас 20-30%"
+            if mape is not None:
+                accuracy_rec = ACCURACY_RECS[np.searchsorted(MAPE_BANDS, mape, side='right')]
 
                 business_recommendations.append(
                     f"🎯 **Точність прогноза (MAPE: {mape:.1f}%)**: {accuracy_rec}"
                 )
 
             # Рекомендація по доверительному интервалу
-            avg_uncertainty = (detailed_forecast['🚀 Оптимістичний'].mean() -
-                             detailed_forecast['😰 Песимістичний'].mean()) / 2
-            avg_forecast = detailed_forecast['🎯 Реальний'].mean()
+            avg_uncertainty = (scen_int_means[2] - scen_int_means[0]) / 2
+            avg_forecast = scen_int_means[1]
             uncertainty_pct = (avg_uncertainty / avg_forecast * 100) if avg_forecast > 0 else 0
 
             business_recommendations.append(
@@ -3126,8 +3465,7 @@ def main():
                 f"Плануйте мінімальний запас по нижній межі, максимальний - по верхній."
             )
 
-            for rec in business_recommendations:
-                st.markdown(f'<div class="insight-card">{rec}</div>', unsafe_allow_html=True)
+            render_cards(business_recommendations)
 
             # Рекомендации по улучшению
             st.markdown("### 🚀 Як покращити точність прогнозу")
@@ -3144,14 +3482,14 @@ def main():
                 st.markdown(f"- {tip}")
 
             # Итоговая рекомендация
+            planning_note = 'дозволяє впевнено планувати' if uncertainty_pct < 20 else 'потребує додаткового страхового запасу'
             st.markdown(
-                '<div class="insight-card" style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; margin-top: 20px;">'
-                '<h4 style="color: white; margin: 0 0 10px 0;">💡 Ключова рекомендація</h4>'
-                f'<p style="margin: 0; font-size: 16px;">На основі аналізу {len(filtered_df)} записів за {data_days} дней, '
-                f'модель прогнозує <strong>{total_forecast:.0f} одиниць</strong> продажів '
-                f'на наступні {forecast_days} дней. {trend_action}. '
-                f'Довірчий інтервал становить ±{uncertainty_pct:.0f}%, что {'дозволяє впевнено планувати' if uncertainty_pct < 20 else 'потребує додаткового страхового запасу'}.</p>'
-                '</div>',
+                KEY_REC_TPL.format(body=(
+                    f'На основі аналізу {n_rows} записів за {data_days} дней, '
+                    f'модель прогнозує <strong>{total_forecast:.0f} одиниць</strong> продажів '
+                    f'на наступні {forecast_days} дней. {trend_action}. '
+                    f'Довірчий інтервал становить ±{uncertainty_pct:.0f}%, что {planning_note}.'
+                )),
                 unsafe_allow_html=True
             )
 
@@ -3161,11 +3499,7 @@ def main():
             col1, col2 = st.columns(2)
             
             with col1:
-                export_data = detailed_forecast.copy()
-                export_data['Магазин'] = selected_magazin
-                export_data['Сегмент'] = selected_segment
-                
-                csv = export_data.to_csv(index=False)
+                csv = forecast_csv_bytes(prophet_key + (forecast_days,), detailed_forecast, selected_magazin, selected_segment)
                 st.download_button(
                     label="📊 Завантажити прогноз (CSV)",
                     data=csv,
@@ -3175,23 +3509,28 @@ def main():
                 )
             
             with col2:
-                # Word отчет
-                word_data = create_word_report(
-                    detailed_forecast, selected_magazin, selected_segment, forecast_days,
-                    total_forecast, avg_daily_forecast, forecast_revenue, confidence_score,
-                    accuracy_metrics, insights, filtered_df, prophet_data
-                )
-                
-                if word_data:
-                    st.download_button(
-                        label="📄 Завантажити звіт (WORD)",
-                        data=word_data,
-                        file_name=f"report_{selected_magazin}_{selected_segment}.docx",
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        use_container_width=True
+                # Word отчет собирается только по запросу, с датой создания на момент нажатия
+                if st.button("📄 Сформувати звіт (WORD)", use_container_width=True):
+                    forecast_rows = (
+                        detailed_forecast['📅 Дата'].to_numpy()[:10],
+                        scen_int[:10, 0], scen_int[:10, 1], scen_int[:10, 2]
                     )
-                else:
-                    st.info("Word недоступний. Установите: pip install python-docx")
+                    word_data = create_word_report(
+                        forecast_rows, selected_magazin, selected_segment, forecast_days,
+                        total_forecast, avg_daily_forecast, forecast_revenue, confidence_score,
+                        accuracy_metrics, insights, filtered_df, prophet_data
+                    )
+                    
+                    if word_data:
+                        st.download_button(
+                            label="📄 Завантажити звіт (WORD)",
+                            data=word_data,
+                            file_name=f"report_{selected_magazin}_{selected_segment}.docx",
+                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                            use_container_width=True
+                        )
+                    else:
+                        st.info("Word недоступний. Установите: pip install python-docx")
 
 if __name__ == "__main__":
     main()